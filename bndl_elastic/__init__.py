@@ -12,12 +12,14 @@
 
 from bndl.compute.context import ComputeContext
 from bndl.compute.dataset import Dataset
-from bndl.util.conf import CSV, String, Int, Bool
+from bndl.util.conf import CSV, String, Int, Float, Bool
 from bndl.util.funcs import as_method
 from bndl_elastic.bulk import elastic_bulk, elastic_create, \
     elastic_index, elastic_update, elastic_delete, elastic_upsert
 from bndl_elastic.client import elastic_client
 from bndl_elastic.dataset import ElasticSearchDataset
+from bndl_elastic.lookup import elastic_lookup, elastic_msearch
+from bndl_elastic.reindex import elastic_reindex
 
 
 # Configuration
@@ -28,15 +30,44 @@ doc_type = String()
 timeout = Int(120)
 max_retries = Int(3)
 retry_on_timeout = Bool(True)
+serializer = String('auto')
+
+pool_size = Int(4)
+pool_max_idle = Int(300)
+pool_wait_timeout = Float(1.0)
+connections_per_host = Int(10)
+tcp_keepalive = Bool(True)
+health_check_interval = Int(60)
+
+slices_per_shard = Int(1)
+scan_docs_per_partition = Int(0)
+scan_engine = String('scroll')
+scan_prefetch = Int(0)
+scan_compact_hits = Bool(False)
 
 bulk_timeout = Int(timeout.default)
 bulk_chunk_size = Int(100)
 bulk_max_chunk_bytes = Int(1 * 1024 * 1024)
+bulk_concurrency = Int(1)
+bulk_adaptive = Bool(False)
+bulk_max_chunk_size = Int(10000)
+bulk_target_latency = Float(1.0)
+bulk_route_to_primaries = Bool(False)
+bulk_coalesce = String()
+bulk_coalesce_window = Int(10000)
+
+lookup_batch_size = Int(1000)
+lookup_concurrency = Int(2)
+lookup_cache_size = Int(10000)
+
+msearch_batch_size = Int(100)
+msearch_concurrency = Int(2)
 
 
 # Bndl API extensions
 ComputeContext.elastic_client = elastic_client
 ComputeContext.elastic_search = as_method(ElasticSearchDataset)
+ComputeContext.elastic_reindex = elastic_reindex
 
 Dataset.elastic_bulk = elastic_bulk
 Dataset.elastic_index = elastic_index
@@ -44,3 +75,5 @@ Dataset.elastic_create = elastic_create
 Dataset.elastic_update = elastic_update
 Dataset.elastic_upsert = elastic_upsert
 Dataset.elastic_delete = elastic_delete
+Dataset.elastic_lookup = elastic_lookup
+Dataset.elastic_msearch = elastic_msearch
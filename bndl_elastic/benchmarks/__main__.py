@@ -0,0 +1,132 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from functools import partial
+from itertools import product
+from urllib.request import Request, urlopen
+import argparse
+import json
+import time
+
+from bndl.compute.run import create_ctx
+from bndl.util.conf import Config
+from bndl_elastic.benchmarks.standin import StandInConfig, StandInElastic
+from bndl_elastic.bulk import execute_bulk
+from bndl_elastic.bulk_body import ActionEncoder
+
+
+INDEX = 'bndl_elastic_bench'
+
+
+def _counters(standin, reset=False):
+    request = Request('http://%s/_standin' % standin.host, method='DELETE' if reset else 'GET')
+    with urlopen(request) as resp:
+        return json.loads(resp.read().decode())
+
+
+def _scan_partition(hits):
+    start = time.process_time()
+    count = 0
+    for _ in hits:
+        count += 1
+    return [(count, time.process_time() - start)]
+
+
+def _bulk_partition(ctx, doc, kwargs, ids):
+    start = time.process_time()
+    docs = ((str(i), doc) for i in ids)
+    stats, = execute_bulk(ctx, docs, encoder=ActionEncoder('create', INDEX), **kwargs)
+    return [(stats.success, time.process_time() - start)]
+
+
+def _run(standin, job):
+    '''
+    Run a job which yields (docs, cpu seconds) per partition and return docs,
+    seconds, the stand-in counters and cpu seconds.
+    '''
+    _counters(standin, reset=True)
+    start = time.monotonic()
+    results = job()
+    elapsed = time.monotonic() - start
+    docs = sum(docs for docs, _ in results)
+    cpu = sum(cpu for _, cpu in results)
+    return docs, elapsed, _counters(standin), cpu
+
+
+def scan(ctx, standin, slices_per_shard, size):
+    dset = ctx.elastic_search(INDEX, slices_per_shard=slices_per_shard, size=size)
+    docs, elapsed, counters, cpu = _run(standin, dset.map_partitions(_scan_partition).collect)
+    return docs, elapsed, counters['bytes_sent'], cpu
+
+
+def bulk(ctx, standin, docs, partitions, chunk_size, concurrency):
+    doc = {'name': 'document', 'number': 42, 'text': 'x' * max(0, standin.config.doc_size - 50)}
+    kwargs = dict(chunk_size=chunk_size, concurrency=concurrency, max_chunk_bytes=2 ** 30)
+    dset = ctx.range(docs, pcount=partitions).map_partitions(partial(_bulk_partition, ctx, doc, kwargs))
+    docs, elapsed, counters, cpu = _run(standin, dset.collect)
+    return docs, elapsed, counters['bytes_received'], cpu
+
+
+def _report(name, params, docs, elapsed, size, cpu):
+    print('%-5s %-50s %10d %8.2f %12.0f %10.2f %10.1f' % (
+        name, ' '.join('%s=%s' % param for param in params), docs, elapsed,
+        docs / elapsed, size / elapsed / 1024 / 1024, cpu / docs * 1e6 if docs else 0))
+
+
+def _ints(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bndl_elastic.benchmarks', description=(
+        'Benchmark the scan and bulk paths of bndl_elastic against a local stand-in for Elastic. '
+        'Reports docs/s, MiB/s (of the scroll responses or bulk requests) and the CPU time of the '
+        'partitions per doc (in microseconds).'))
+    parser.add_argument('scenario', nargs='?', choices=('scan', 'bulk', 'all'), default='all')
+    parser.add_argument('--workers', type=int, default=4, help='the number of bndl workers')
+    parser.add_argument('--latency', type=float, default=0, help='the latency of each request in seconds')
+    parser.add_argument('--shards', type=int, default=4, help='the number of shards of the index')
+    parser.add_argument('--docs', type=int, default=100000, help='the number of docs to scan or index')
+    parser.add_argument('--doc-sizes', type=_ints, default=[100, 1000, 10000], help='doc sizes in bytes')
+    parser.add_argument('--slices', type=_ints, default=[1, 4], help='(scan) slices per shard')
+    parser.add_argument('--page-sizes', type=_ints, default=[1000], help='(scan) hits per page')
+    parser.add_argument('--chunk-sizes', type=_ints, default=[100, 1000], help='(bulk) actions per request')
+    parser.add_argument('--concurrency', type=_ints, default=[1, 4], help='(bulk) requests in flight per partition')
+    parser.add_argument('--partitions', type=_ints, default=[4, 16], help='(bulk) the number of partitions')
+    args = parser.parse_args(argv)
+
+    ctx = create_ctx(config=Config({'bndl.compute.worker_count': args.workers}))
+    try:
+        print('%-5s %-50s %10s %8s %12s %10s %10s' % ('', 'parameters', 'docs', 'seconds', 'docs/s', 'MiB/s',
+                                                      'cpu us/doc'))
+        for doc_size in args.doc_sizes:
+            config = StandInConfig(shards=args.shards, docs_per_shard=args.docs // args.shards,
+                                   doc_size=doc_size, latency=args.latency)
+            with StandInElastic(config) as standin:
+                ctx.conf['bndl_elastic.hosts'] = standin.host
+                if args.scenario in ('scan', 'all'):
+                    for slices, size in product(args.slices, args.page_sizes):
+                        params = (('doc_size', doc_size), ('slices', slices), ('page_size', size))
+                        _report('scan', params, *scan(ctx, standin, slices, size))
+                if args.scenario in ('bulk', 'all'):
+                    for partitions, chunk_size, concurrency in product(args.partitions, args.chunk_sizes,
+                                                                       args.concurrency):
+                        params = (('doc_size', doc_size), ('partitions', partitions),
+                                  ('chunk_size', chunk_size), ('concurrency', concurrency))
+                        _report('bulk', params, *bulk(ctx, standin, args.docs, partitions, chunk_size,
+                                                      concurrency))
+    finally:
+        ctx.stop()
+
+
+if __name__ == '__main__':
+    main()
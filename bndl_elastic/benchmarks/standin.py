@@ -0,0 +1,307 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+A stand-in for Elastic which serves just enough of the HTTP API to scan and
+bulk index with bndl_elastic: the root (version info), _search_shards,
+_count, _search with scroll, _search/scroll and _bulk.
+
+The index is synthetic: every index has the configured number of shards with
+the configured number of documents of (about) the configured size. Bulk
+actions are acknowledged without being stored. Every request is delayed by
+the configured latency.
+'''
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+import base64
+import json
+import multiprocessing
+import threading
+import time
+
+
+VERSION = '7.10.2'
+
+
+class StandInConfig(object):
+    '''
+    :param shards: int
+        The number of shards per index.
+    :param docs_per_shard: int
+        The number of documents per shard.
+    :param doc_size: int
+        The (approximate) size of the documents in bytes.
+    :param latency: float
+        The latency of each request in seconds.
+    '''
+
+    def __init__(self, shards=4, docs_per_shard=10000, doc_size=1000, latency=0):
+        self.shards = shards
+        self.docs_per_shard = docs_per_shard
+        self.doc_size = doc_size
+        self.latency = latency
+
+
+
+class _Counters(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes_received = 0
+            self.bytes_sent = 0
+            self.docs_sent = 0
+            self.docs_received = 0
+
+
+    def add(self, received, sent, docs_received=0, docs_sent=0):
+        with self.lock:
+            self.requests += 1
+            self.bytes_received += received
+            self.bytes_sent += sent
+            self.docs_received += docs_received
+            self.docs_sent += docs_sent
+
+
+    def as_dict(self):
+        with self.lock:
+            return dict(requests=self.requests, bytes_received=self.bytes_received, bytes_sent=self.bytes_sent,
+                        docs_received=self.docs_received, docs_sent=self.docs_sent)
+
+
+
+def _encode_scroll_id(state):
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode()
+
+
+def _decode_scroll_id(scroll_id):
+    return json.loads(base64.urlsafe_b64decode(scroll_id.encode()).decode())
+
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # set on the subclass created per server
+    config = None
+    counters = None
+    source = None
+
+    def log_message(self, *args):
+        pass
+
+
+    def do_GET(self):
+        self._handle()
+
+    do_POST = do_PUT = do_DELETE = do_HEAD = do_GET
+
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        path = [segment for segment in url.path.split('/') if segment]
+
+        if self.config.latency:
+            time.sleep(self.config.latency)
+
+        docs_received = docs_sent = 0
+        endpoints = [segment for segment in path if segment.startswith('_')]
+        endpoint = endpoints[0] if endpoints else None
+        if not path:
+            status, resp = 200, self._info()
+        elif endpoint == '_standin':
+            status, resp = 200, json.dumps(self.counters.as_dict())
+            if self.command == 'DELETE':
+                self.counters.reset()
+        elif endpoint == '_search_shards':
+            status, resp = 200, self._search_shards(path[0])
+        elif endpoint == '_count':
+            status, resp = 200, json.dumps({'count': self.config.shards * self.config.docs_per_shard})
+        elif endpoint == '_search' and 'scroll' in path:
+            if self.command == 'DELETE':
+                status, resp = 200, json.dumps({'succeeded': True, 'num_freed': 1})
+            else:
+                scroll_id = path[-1] if path[-1] != 'scroll' else None
+                if body:
+                    scroll_id = json.loads(body.decode()).get('scroll_id', scroll_id)
+                scroll_id = params.get('scroll_id', scroll_id)
+                status, resp, docs_sent = self._page(_decode_scroll_id(scroll_id))
+        elif endpoint == '_search':
+            status, resp, docs_sent = self._search(path[0], params, json.loads(body.decode()) if body else {})
+        elif endpoint == '_bulk':
+            status, resp, docs_received = self._bulk(body)
+        else:
+            status, resp = 404, json.dumps({'error': 'unsupported endpoint %s' % url.path, 'status': 404})
+
+        resp = resp.encode()
+        self.counters.add(len(body), len(resp), docs_received, docs_sent)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(resp)))
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(resp)
+
+
+    def _info(self):
+        return json.dumps({
+            'name': 'standin',
+            'cluster_name': 'standin',
+            'version': {'number': VERSION, 'build_flavor': 'default'},
+            'tagline': 'You Know, for Search',
+        })
+
+
+    def _search_shards(self, index):
+        host, port = self.server.server_address[:2]
+        return json.dumps({
+            'nodes': {'standin': {'name': 'standin', 'transport_address': '%s:%s' % (host, port)}},
+            'shards': [
+                [{'index': index, 'shard': shard, 'node': 'standin', 'primary': True, 'state': 'STARTED'}]
+                for shard in range(self.config.shards)
+            ],
+        })
+
+
+    def _search(self, index, params, body):
+        preference = params.get('preference', '')
+        if preference.startswith('_shards:'):
+            shards = [int(shard) for shard in preference[len('_shards:'):].split(',')]
+        else:
+            shards = list(range(self.config.shards))
+        start, end = 0, self.config.docs_per_shard
+        if 'slice' in body:
+            slice_id, slice_max = body['slice']['id'], body['slice']['max']
+            per_slice = -(-self.config.docs_per_shard // slice_max)
+            start, end = slice_id * per_slice, min(end, (slice_id + 1) * per_slice)
+        size = int(params.get('size') or body.get('size') or 10)
+        return self._page(dict(index=index, shards=shards, shard=0, pos=start, end=end, size=size))
+
+
+    def _page(self, state):
+        '''
+        A page of hits and the scroll id of the next page.
+        '''
+        hits = []
+        while len(hits) < state['size'] and state['shard'] < len(state['shards']):
+            shard = state['shards'][state['shard']]
+            count = min(state['size'] - len(hits), state['end'] - state['pos'])
+            prefix = '{"_index":%s,"_type":"_doc","_id":"' % json.dumps(state['index'])
+            suffix = '","_score":1.0,"_source":%s}' % self.source
+            for doc_no in range(state['pos'], state['pos'] + count):
+                hits.append('%s%s-%s%s' % (prefix, shard, doc_no, suffix))
+            state['pos'] += count
+            if state['pos'] >= state['end']:
+                state['shard'] += 1
+                state['pos'] = 0
+        total = len(state['shards']) * self.config.docs_per_shard
+        resp = ('{"_scroll_id":"%s","took":1,"timed_out":false,'
+                '"_shards":{"total":%s,"successful":%s,"skipped":0,"failed":0},'
+                '"hits":{"total":%s,"max_score":1.0,"hits":[%s]}}') % (
+            _encode_scroll_id(state), len(state['shards']), len(state['shards']), total, ','.join(hits))
+        return 200, resp, len(hits)
+
+
+    def _bulk(self, body):
+        lines = body.decode().split('\n')
+        items = []
+        idx = 0
+        while idx < len(lines):
+            header = lines[idx]
+            idx += 1
+            if not header:
+                continue
+            op_type = header[2:header.index('"', 2)]
+            if op_type != 'delete':
+                idx += 1
+            items.append('{"%s":{"_id":"%s","status":%s,"result":"%s"}}' % (
+                op_type, len(items), 200 if op_type in ('update', 'delete') else 201,
+                'deleted' if op_type == 'delete' else 'created'))
+        return 200, '{"took":1,"errors":false,"items":[%s]}' % ','.join(items), len(items)
+
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+
+def create_server(config, host='127.0.0.1', port=0):
+    '''
+    Create a (threading) HTTP server for the stand-in. The server is bound,
+    but not yet serving.
+    '''
+    source = json.dumps({
+        'name': 'document',
+        'number': 42,
+        'text': 'x' * max(0, config.doc_size - 50),
+    })
+    handler = type('Handler', (StandInHandler,), dict(config=config, counters=_Counters(), source=source))
+    return _ThreadingHTTPServer((host, port), handler)
+
+
+def _serve(config, host, port, conn):
+    server = create_server(config, host, port)
+    conn.send(server.server_address[:2])
+    server.serve_forever()
+
+
+
+class StandInElastic(object):
+    '''
+    Runs the stand-in in a separate process (so it doesn't compete for the
+    GIL with the process under test). Use as context manager::
+
+        with StandInElastic(StandInConfig(latency=.005)) as standin:
+            ctx.conf['bndl_elastic.hosts'] = standin.host
+    '''
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = config or StandInConfig()
+        self.host = None
+        self._address = (host, port)
+        self._process = None
+
+
+    def start(self):
+        parent, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(self.config,) + self._address + (child,),
+                                                name='bndl_elastic-standin', daemon=True)
+        self._process.start()
+        host, port = parent.recv()
+        self.host = '%s:%s' % (host, port)
+        return self
+
+
+    def stop(self):
+        if self._process:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *args):
+        self.stop()
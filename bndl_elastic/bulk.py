@@ -10,10 +10,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from bisect import bisect_left
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from functools import partial
+import json
+import logging
+import threading
+import time
 
+from bndl_elastic.bulk_body import ActionEncoder, bulk_body, chunk_actions, encode_action
 from bndl_elastic.client import elastic_client, resource_from_conf
-from elasticsearch.helpers import bulk
+from bndl_elastic.coalesce import coalesced
+from bndl_elastic.metrics import metrics
+from bndl_elastic.routing import ShardRouting, partition_by_shard
+from bndl_elastic.tuning import BulkLoadDataset
+from elasticsearch.exceptions import TransportError
+from elasticsearch.helpers import BulkIndexError
+
+
+logger = logging.getLogger(__name__)
 
 
 def _refresh_index(job, name, hosts=None):
@@ -21,7 +37,361 @@ def _refresh_index(job, name, hosts=None):
         client.indices.refresh(name)
 
 
-def execute_bulk(ctx, actions, hosts=None, **kwargs):
+class AdaptiveChunkSize(object):
+    '''
+    Chunk size for bulk requests which grows while requests complete within
+    the target latency and shrinks when requests are slow or rejected by
+    Elastic (HTTP 429 / es_rejected_execution_exception). Consecutive
+    rejections back off exponentially.
+    '''
+
+    def __init__(self, size, min_size=10, max_size=10000, target_latency=1.0,
+                 initial_backoff=.5, max_backoff=30):
+        self.min_size = max(1, min(min_size, size))
+        self.max_size = max(max_size, size)
+        self.size = size
+        self.target_latency = target_latency
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.rejections = 0
+        self._lock = threading.Lock()
+
+
+    def __call__(self):
+        with self._lock:
+            return self.size
+
+
+    def completed(self, latency):
+        '''
+        Register a bulk request which completed in latency seconds.
+        '''
+        with self._lock:
+            self.rejections = 0
+            if latency <= self.target_latency:
+                self.size = min(self.max_size, self.size + max(1, self.size // 4))
+            else:
+                self.size = max(self.min_size, int(self.size * self.target_latency / latency))
+
+
+    def rejected(self):
+        '''
+        Register a rejected bulk request.
+
+        :return: float
+            The number of seconds to back off.
+        '''
+        with self._lock:
+            self.size = max(self.min_size, self.size // 2)
+            backoff = min(self.max_backoff, self.initial_backoff * 2 ** self.rejections)
+            self.rejections += 1
+            return backoff
+
+
+
+def _item_status(item):
+    return next(iter(item.values())).get('status')
+
+
+def _error_type(item):
+    result = next(iter(item.values()))
+    error = result.get('error')
+    if isinstance(error, dict):
+        return error.get('type', 'unknown')
+    elif isinstance(error, str):
+        return error.split('[', 1)[0]
+    else:
+        return str(result.get('status', 'unknown'))
+
+
+
+class BulkStats(object):
+    '''
+    Statistics of the execution of bulk actions. Stats of partitions can be
+    added up, e.g. with ``dset.elastic_index(...).sum()``.
+
+    :ivar success: Number of actions executed successfully.
+    :ivar failed: Number of actions which failed.
+    :ivar errors: Number of failed actions by error type.
+    :ivar retries: Number of actions retried (e.g. after rejection).
+    :ivar requests: Number of bulk requests sent.
+    :ivar bytes: Size of the bulk requests sent.
+    :ivar request_time: Total time spent in bulk requests (in seconds).
+    :ivar latencies: Histogram of the bulk request latencies, counts per
+        bucket with the upper bounds in BulkStats.latency_buckets.
+    :ivar min_chunk_size, max_chunk_size: The range of chunk sizes used.
+    :ivar dead_letters: The actions which failed (see execute_bulk).
+    :ivar elapsed: Total time spent executing partitions (in seconds).
+    :ivar start, end: Wall clock time of start and end of execution.
+    '''
+
+    latency_buckets = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, float('inf'))
+
+    def __init__(self):
+        self.success = 0
+        self.failed = 0
+        self.errors = Counter()
+        self.retries = 0
+        self.requests = 0
+        self.bytes = 0
+        self.request_time = 0
+        self.latencies = [0] * len(self.latency_buckets)
+        self.min_chunk_size = None
+        self.max_chunk_size = None
+        self.dead_letters = []
+        self.partitions = 0
+        self.elapsed = 0
+        self.start = None
+        self.end = None
+
+
+    @property
+    def docs_per_second(self):
+        duration = (self.end - self.start) if self.start is not None else 0
+        return (self.success + self.failed) / duration if duration else 0
+
+
+    @property
+    def bytes_per_second(self):
+        duration = (self.end - self.start) if self.start is not None else 0
+        return self.bytes / duration if duration else 0
+
+
+    def _item(self, ok, item):
+        if ok:
+            self.success += 1
+        else:
+            self.failed += 1
+            self.errors[_error_type(item)] += 1
+
+
+    def _request(self, size, latency):
+        self.requests += 1
+        self.bytes += size
+        self.request_time += latency
+        self.latencies[bisect_left(self.latency_buckets, latency)] += 1
+
+
+    def _chunk(self, size):
+        self.min_chunk_size = size if self.min_chunk_size is None else min(self.min_chunk_size, size)
+        self.max_chunk_size = size if self.max_chunk_size is None else max(self.max_chunk_size, size)
+
+
+    def __add__(self, other):
+        if not isinstance(other, BulkStats):
+            return NotImplemented
+        total = BulkStats()
+        for attr in ('success', 'failed', 'errors', 'retries', 'requests', 'bytes',
+                     'request_time', 'partitions', 'elapsed'):
+            setattr(total, attr, getattr(self, attr) + getattr(other, attr))
+        total.latencies = [a + b for a, b in zip(self.latencies, other.latencies)]
+        total.dead_letters = self.dead_letters + other.dead_letters
+        for attr, select in (('min_chunk_size', min), ('max_chunk_size', max),
+                             ('start', min), ('end', max)):
+            values = [v for v in (getattr(self, attr), getattr(other, attr)) if v is not None]
+            setattr(total, attr, select(values) if values else None)
+        return total
+
+
+    def __radd__(self, other):
+        # support sum(...) which starts with 0
+        if other == 0:
+            return self
+        return self.__add__(other)
+
+
+    def __repr__(self):
+        return '<BulkStats success=%s failed=%s requests=%s bytes=%s docs/s=%.1f>' % (
+            self.success, self.failed, self.requests, self.bytes, self.docs_per_second)
+
+
+
+# statuses of bulk requests and items which are retried
+RETRY_STATUS = (429, 503)
+
+
+def _dead_letter(action, item):
+    header, source = action
+    return {
+        'action': json.loads(header),
+        'source': json.loads(source) if source is not None else None,
+        'error': next(iter(item.values())),
+    }
+
+
+def _execute_chunk(client, chunk_size, chunk, raise_on_error=True, raise_on_exception=True,
+                   max_rejections=10, initial_backoff=.5, max_backoff=30, dead_letter=None, **kwargs):
+    '''
+    Execute a chunk of encoded actions and return the BulkStats of the
+    execution.
+
+    Actions (or whole requests) which fail with a status in RETRY_STATUS are
+    retried, at most max_rejections times, after an exponential backoff. If
+    chunk_size is an AdaptiveChunkSize, the latency of the requests and the
+    rejections are reported to chunk_size (which determines the backoff).
+
+    :param dead_letter: callable (optional)
+        Called with a list of dead letters (dicts with the action, source and
+        error of the actions which failed permanently) instead of raising a
+        BulkIndexError.
+    '''
+    stats = BulkStats()
+    stats._chunk(len(chunk))
+    adaptive = isinstance(chunk_size, AdaptiveChunkSize)
+    failed = []
+
+    for attempt in range(max_rejections + 1):
+        retry = []
+        body = bulk_body(chunk)
+        start = time.monotonic()
+        try:
+            resp = client.bulk(body, **kwargs)
+        except TransportError as exc:
+            latency = time.monotonic() - start
+            stats._request(len(body), latency)
+            if exc.status_code in RETRY_STATUS:
+                retry = chunk
+            elif raise_on_exception:
+                raise
+            else:
+                for action in chunk:
+                    item = {'error': {'status': exc.status_code, 'error': str(exc)}}
+                    stats._item(False, item)
+                    failed.append((action, item))
+        else:
+            latency = time.monotonic() - start
+            stats._request(len(body), latency)
+            for action, item in zip(chunk, resp['items']):
+                status = _item_status(item)
+                if status in RETRY_STATUS:
+                    retry.append(action)
+                else:
+                    ok = status is not None and 200 <= status < 300
+                    stats._item(ok, item)
+                    if not ok:
+                        failed.append((action, item))
+
+        if not retry:
+            if adaptive:
+                chunk_size.completed(latency)
+            break
+
+        if adaptive:
+            backoff = chunk_size.rejected()
+        else:
+            backoff = min(max_backoff, initial_backoff * 2 ** attempt)
+        logger.debug('%s of %s bulk actions rejected, backing off %.1f seconds', len(retry), len(chunk), backoff)
+        time.sleep(backoff)
+        stats.retries += len(retry)
+        chunk = retry
+    else:
+        for action in retry:
+            item = {'rejected': {'status': 429, 'error': {'type': 'es_rejected_execution_exception'}}}
+            stats._item(False, item)
+            failed.append((action, item))
+
+    metrics.docs_processed('bulk', stats.success + stats.failed)
+    if failed and dead_letter is not None:
+        dead_letter([_dead_letter(action, item) for action, item in failed])
+    elif failed and raise_on_error:
+        errors = [item for _, item in failed]
+        raise BulkIndexError('%i document(s) failed to index.' % len(errors), errors)
+    return stats
+
+
+def _pipeline(chunks, concurrency, execute, ordered=False):
+    '''
+    Apply execute to chunks with at most concurrency chunks in flight and
+    yield the results (in the order of chunks if ordered, otherwise in order
+    of completion). Reading chunks is held back while all threads are busy so
+    memory usage stays bounded.
+    '''
+    if concurrency <= 1:
+        for chunk in chunks:
+            yield execute(chunk)
+        return
+
+    if ordered:
+        pending = deque()
+        with ThreadPoolExecutor(concurrency) as executor:
+            try:
+                for chunk in chunks:
+                    if len(pending) >= concurrency:
+                        yield pending.popleft().result()
+                    pending.append(executor.submit(execute, chunk))
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+        return
+
+    pending = set()
+    with ThreadPoolExecutor(concurrency) as executor:
+        try:
+            for chunk in chunks:
+                if len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(executor.submit(execute, chunk))
+            while pending:
+                yield pending.pop().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class DeadLetterFile(object):
+    '''
+    Appends dead letters as JSON lines to a file (on the worker executing the
+    bulk actions).
+    '''
+
+    _lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+
+
+    def __call__(self, dead_letters):
+        lines = ''.join(json.dumps(dead_letter) + '\n' for dead_letter in dead_letters)
+        with self._lock, open(self.path, 'a') as f:
+            f.write(lines)
+
+
+
+# arguments of elasticsearch.helpers.bulk and the arguments of _execute_chunk
+# they correspond with
+_HELPER_ARGS = {
+    'max_retries': 'max_rejections',
+}
+
+# arguments of elasticsearch.helpers.bulk which have no equivalent here
+_UNSUPPORTED_HELPER_ARGS = ('stats_only', 'yield_ok', 'expand_action_callback')
+
+
+def _bulk_kwargs(kwargs):
+    '''
+    Map the arguments of elasticsearch.helpers.bulk in kwargs to the arguments
+    of _execute_chunk and raise a TypeError for the arguments which aren't
+    supported (instead of failing in the bulk API of the client).
+    '''
+    unsupported = [key for key in _UNSUPPORTED_HELPER_ARGS if key in kwargs]
+    if unsupported:
+        raise TypeError('Unsupported argument(s) for bulk actions: %s (the results are reported as BulkStats, '
+                        'see execute_bulk)' % ', '.join(unsupported))
+    kwargs = dict(kwargs)
+    for key, arg in _HELPER_ARGS.items():
+        if key in kwargs:
+            if arg in kwargs:
+                raise TypeError('Both %s and %s given' % (key, arg))
+            kwargs[arg] = kwargs.pop(key)
+    return kwargs
+
+
+def execute_bulk(ctx, actions, hosts=None, concurrency=None, adaptive=None, encoder=None, dead_letter=None,
+                 coalesce=None, coalesce_window=None, **kwargs):
     '''
     Perform actions on Elastic in bulk.
     
@@ -34,19 +404,96 @@ def execute_bulk(ctx, actions, hosts=None, **kwargs):
         An iterable of actions to execute.
     :param hosts: str or iterable (optional)
         Hosts which serve as contact points for the Elastic client.
+    :param concurrency: int (optional)
+        The maximum number of bulk requests in flight. Defaults to
+        ctx.conf['bndl_elastic.bulk_concurrency'].
+    :param adaptive: bool (optional)
+        Whether to adapt the chunk size to the latency of the bulk requests
+        and to back off and retry when Elastic rejects requests. Defaults to
+        ctx.conf['bndl_elastic.bulk_adaptive'].
+    :param encoder: bndl_elastic.bulk_body.ActionEncoder (optional)
+        Encoder for the elements of actions. If not set, the actions are
+        expected in the format of elasticsearch.helpers.bulk.
+    :param dead_letter: bool, str or callable (optional)
+        Where to route actions which failed permanently (i.e. after retrying
+        rejections), instead of failing with a BulkIndexError: True to keep
+        them in BulkStats.dead_letters, the path of a file to append them to
+        as JSON lines or a callable which is called with lists of them. Dead
+        letters are dicts with the action (meta data), source and error.
+    :param coalesce: str or callable (optional)
+        Coalesce actions on the same document before sending them (see
+        bndl_elastic.coalesce) with the given merge strategy for partial
+        documents: 'merge' (deep merge), 'last' (last write wins) or a
+        function. Defaults to ctx.conf['bndl_elastic.bulk_coalesce'] (not
+        set means no coalescing).
+    :param coalesce_window: int (optional)
+        The maximum number of documents buffered for coalescing. Defaults to
+        ctx.conf['bndl_elastic.bulk_coalesce_window'].
     :param kwargs: 
-        Keyword arguments passed on to the elasticsearch bulk function.
-        Default values are read from ctx.conf['bndl_elastic.bulk_*'].
+        chunk_size, max_chunk_bytes, raise_on_error, raise_on_exception,
+        max_rejections (or max_retries), initial_backoff and max_backoff as
+        for elasticsearch.helpers.bulk; other keyword arguments (e.g.
+        request_timeout, pipeline or routing) are passed on to the bulk API
+        of the Elastic client. Default values are read from
+        ctx.conf['bndl_elastic.bulk_*'].
+    :return: (BulkStats,)
     '''
+    kwargs = _bulk_kwargs(kwargs)
     kwargs.setdefault('chunk_size', ctx.conf['bndl_elastic.bulk_chunk_size'])
     kwargs.setdefault('max_chunk_bytes', ctx.conf['bndl_elastic.bulk_max_chunk_bytes'])
     kwargs.setdefault('request_timeout', ctx.conf['bndl_elastic.bulk_timeout'])
+    if concurrency is None:
+        concurrency = ctx.conf['bndl_elastic.bulk_concurrency']
+    if adaptive is None:
+        adaptive = ctx.conf['bndl_elastic.bulk_adaptive']
+
+    if coalesce is None:
+        coalesce = ctx.conf['bndl_elastic.bulk_coalesce']
+    if coalesce:
+        if coalesce_window is None:
+            coalesce_window = ctx.conf['bndl_elastic.bulk_coalesce_window']
+        actions = coalesced(actions, encoder, coalesce, coalesce_window)
+
+    size = kwargs.pop('chunk_size')
+    max_chunk_bytes = kwargs.pop('max_chunk_bytes')
+    if adaptive:
+        chunk_size = AdaptiveChunkSize(
+            size,
+            max_size=ctx.conf['bndl_elastic.bulk_max_chunk_size'],
+            target_latency=ctx.conf['bndl_elastic.bulk_target_latency'],
+        )
+    else:
+        chunk_size = lambda: size
+
+    dead_letters = []
+    if dead_letter is True:
+        kwargs['dead_letter'] = dead_letters.extend
+    elif isinstance(dead_letter, str):
+        kwargs['dead_letter'] = DeadLetterFile(dead_letter)
+    elif dead_letter:
+        kwargs['dead_letter'] = dead_letter
+
+    start = time.time()
+    started = time.monotonic()
     with elastic_client(ctx, hosts=hosts) as client:
-        stats = bulk(client, actions, stats_only=True, **kwargs)
-        return (stats[0],)
+        serializer = client.transport.serializer
+        if encoder:
+            encoded = map(encoder(serializer), actions)
+        else:
+            encoded = map(partial(encode_action, serializer), actions)
+        chunks = chunk_actions(encoded, chunk_size, max_chunk_bytes)
+        execute = partial(_execute_chunk, client, chunk_size, **kwargs)
+        stats = sum(_pipeline(chunks, concurrency, execute), BulkStats())
 
+    stats.dead_letters = dead_letters
+    stats.partitions = 1
+    stats.elapsed = time.monotonic() - started
+    stats.start = start
+    stats.end = start + stats.elapsed
+    return (stats,)
 
-def elastic_bulk(self, refresh_index=None, hosts=None, **kwargs):
+
+def elastic_bulk(self, refresh_index=None, hosts=None, bulk_load_mode=None, **kwargs):
     '''
     Perform actions on Elastic in bulk.
     
@@ -57,18 +504,48 @@ def elastic_bulk(self, refresh_index=None, hosts=None, **kwargs):
         Comma separated name of the indices to refresh or None to skip.
     :param hosts: str or iterable (optional)
         Hosts which serve as contact points for the Elastic client.
+    :param bulk_load_mode: str or bool (optional)
+        Comma separated names of the indices (or True for the indices in
+        refresh_index) to tune for the bulk load: refresh and replicas are
+        disabled and the translog durability is set to async (see
+        bndl_elastic.tuning). The settings are changed when a job of the
+        dataset is started and restored, after which the indices are
+        refreshed, in the cleanup of the job. Use bndl_elastic.tuning.bulk_load_mode to tune
+        indices for the duration of a block instead.
     :param kwargs: 
-        Keyword arguments passed on to the elasticsearch bulk function.
-        Default values are read from ctx.conf['bndl_elastic.bulk_*'].
+        Keyword arguments passed on to execute_bulk (e.g. concurrency,
+        dead_letter, chunk_size or max_rejections). Default values are read
+        from ctx.conf['bndl_elastic.bulk_*'].
+    :return: Dataset
+        A dataset with a BulkStats object per partition, use e.g. ``sum()``
+        to get the BulkStats for the whole dataset.
     '''
+    kwargs = _bulk_kwargs(kwargs)
     exec_bulk = self.map_partitions(partial(execute_bulk, self.ctx, hosts=hosts, **kwargs))
-    if refresh_index:
+    if bulk_load_mode is True:
+        bulk_load_mode = refresh_index
+        if not bulk_load_mode:
+            raise ValueError('bulk_load_mode requires the names of the indices to tune')
+    if bulk_load_mode:
+        exec_bulk = BulkLoadDataset(exec_bulk, bulk_load_mode, hosts)
+    elif refresh_index:
         exec_bulk.cleanup = partial(_refresh_index, name=refresh_index, hosts=hosts)
     return exec_bulk
 
 
-def _elastic_bulk(actions, index=None, doc_type=None, refresh=False, hosts=None, **kwargs):
-    return actions.elastic_bulk(refresh_index=index if refresh else None, hosts=hosts, **kwargs)
+def _elastic_bulk(dset, encoder, refresh=False, hosts=None, route_to_primaries=None, bulk_load_mode=None,
+                  **kwargs):
+    if route_to_primaries is None:
+        route_to_primaries = dset.ctx.conf['bndl_elastic.bulk_route_to_primaries']
+    if route_to_primaries:
+        if encoder.op_type == 'index':
+            raise ValueError('Routing to primaries requires document ids')
+        routing = ShardRouting.fetch(dset.ctx, encoder.index, hosts)
+        dset = partition_by_shard(dset, routing, encoder.doc_id)
+    if bulk_load_mode is True:
+        bulk_load_mode = encoder.index
+    return dset.elastic_bulk(refresh_index=encoder.index if refresh else None, hosts=hosts,
+                             bulk_load_mode=bulk_load_mode, encoder=encoder, **kwargs)
 
 
 def elastic_index(self, index=None, doc_type=None, refresh=False, hosts=None, **kwargs):
@@ -83,17 +560,14 @@ def elastic_index(self, index=None, doc_type=None, refresh=False, hosts=None, **
         Whether to refresh the index.
     :param hosts: str or iterable (optional)
         Hosts which serve as contact points for the Elastic client.
+    :param bulk_load_mode: bool (optional)
+        Whether to tune the index for the bulk load, see elastic_bulk.
     :param kwargs:
-        Keyword arguments passed on to the elasticsearch bulk function.
+        Keyword arguments passed on to execute_bulk, see elastic_bulk.
         Default values are read from ctx.conf['bndl_elastic.bulk_*'].
     '''
     index, doc_type = resource_from_conf(self.ctx.conf, index, doc_type)
-    return _elastic_bulk(self.map(lambda doc: {
-        '_op_type': 'index',
-        '_index': index,
-        '_type': doc_type,
-        '_source': doc,
-    }), index, doc_type, refresh, hosts, **kwargs)
+    return _elastic_bulk(self, ActionEncoder('index', index, doc_type), refresh, hosts, **kwargs)
 
 
 def elastic_create(self, index=None, doc_type=None, refresh=False, hosts=None, **kwargs):
@@ -110,18 +584,18 @@ def elastic_create(self, index=None, doc_type=None, refresh=False, hosts=None, *
         Whether to refresh the index afterwards.
     :param hosts: str or iterable (optional)
         Hosts which serve as contact points for the Elastic client.
+    :param route_to_primaries: bool (optional)
+        Whether to repartition the dataset by shard and write each partition
+        from the node of the primary of the shard. Defaults to
+        ctx.conf['bndl_elastic.bulk_route_to_primaries'].
+    :param bulk_load_mode: bool (optional)
+        Whether to tune the index for the bulk load, see elastic_bulk.
     :param kwargs:
-        Keyword arguments passed on to the elasticsearch bulk function.
+        Keyword arguments passed on to execute_bulk, see elastic_bulk.
         Default values are read from ctx.conf['bndl_elastic.bulk_*'].
     '''
     index, doc_type = resource_from_conf(self.ctx.conf, index, doc_type)
-    return _elastic_bulk(self.starmap(lambda doc_id, doc: {
-        '_op_type': 'create',
-        '_index': index,
-        '_type': doc_type,
-        '_id': doc_id,
-        '_source': doc,
-    }), index, doc_type, refresh, hosts, **kwargs)
+    return _elastic_bulk(self, ActionEncoder('create', index, doc_type), refresh, hosts, **kwargs)
 
 
 def elastic_update(self, index=None, doc_type=None, refresh=False, hosts=None, **kwargs):
@@ -137,18 +611,22 @@ def elastic_update(self, index=None, doc_type=None, refresh=False, hosts=None, *
         Whether to refresh the index afterwards.
     :param hosts: str or iterable (optional)
         Hosts which serve as contact points for the Elastic client.
+    :param route_to_primaries: bool (optional)
+        Whether to repartition the dataset by shard and write each partition
+        from the node of the primary of the shard. Defaults to
+        ctx.conf['bndl_elastic.bulk_route_to_primaries'].
+    :param bulk_load_mode: bool (optional)
+        Whether to tune the index for the bulk load, see elastic_bulk.
+    :param coalesce: str (optional)
+        Merge the partial documents of updates of the same document id in a
+        partition with 'merge' (deep merge) or 'last' (last write wins), see
+        execute_bulk.
     :param kwargs:
-        Keyword arguments passed on to the elasticsearch bulk function.
+        Keyword arguments passed on to execute_bulk, see elastic_bulk.
         Default values are read from ctx.conf['bndl_elastic.bulk_*'].
     '''
     index, doc_type = resource_from_conf(self.ctx.conf, index, doc_type)
-    return _elastic_bulk(self.starmap(lambda doc_id, doc: {
-        '_op_type': 'update',
-        '_index': index,
-        '_type': doc_type,
-        '_id': doc_id,
-        'doc': doc,
-    }), index, doc_type, refresh, hosts, **kwargs)
+    return _elastic_bulk(self, ActionEncoder('update', index, doc_type), refresh, hosts, **kwargs)
 
 
 def elastic_upsert(self, index=None, doc_type=None, refresh=False, hosts=None, **kwargs):
@@ -164,19 +642,22 @@ def elastic_upsert(self, index=None, doc_type=None, refresh=False, hosts=None, *
         Whether to refresh the index afterwards.
     :param hosts: str or iterable (optional)
         Hosts which serve as contact points for the Elastic client.
+    :param route_to_primaries: bool (optional)
+        Whether to repartition the dataset by shard and write each partition
+        from the node of the primary of the shard. Defaults to
+        ctx.conf['bndl_elastic.bulk_route_to_primaries'].
+    :param bulk_load_mode: bool (optional)
+        Whether to tune the index for the bulk load, see elastic_bulk.
+    :param coalesce: str (optional)
+        Merge the partial documents of updates of the same document id in a
+        partition with 'merge' (deep merge) or 'last' (last write wins), see
+        execute_bulk.
     :param kwargs:
-        Keyword arguments passed on to the elasticsearch bulk function.
+        Keyword arguments passed on to execute_bulk, see elastic_bulk.
         Default values are read from ctx.conf['bndl_elastic.bulk_*'].
     '''
     index, doc_type = resource_from_conf(self.ctx.conf, index, doc_type)
-    return _elastic_bulk(self.starmap(lambda doc_id, doc: {
-        '_op_type': 'update',
-        '_index': index,
-        '_type': doc_type,
-        '_id': doc_id,
-        'doc': doc,
-        'doc_as_upsert': True
-    }), index, doc_type, refresh, hosts, **kwargs)
+    return _elastic_bulk(self, ActionEncoder('update', index, doc_type, doc_as_upsert=True), refresh, hosts, **kwargs)
 
 
 def elastic_delete(self, index=None, doc_type=None, refresh=False, hosts=None, **kwargs):
@@ -191,14 +672,15 @@ def elastic_delete(self, index=None, doc_type=None, refresh=False, hosts=None, *
         Whether to refresh the index afterwards.
     :param hosts: str or iterable (optional)
         Hosts which serve as contact points for the Elastic client.
+    :param route_to_primaries: bool (optional)
+        Whether to repartition the dataset by shard and write each partition
+        from the node of the primary of the shard. Defaults to
+        ctx.conf['bndl_elastic.bulk_route_to_primaries'].
+    :param bulk_load_mode: bool (optional)
+        Whether to tune the index for the bulk load, see elastic_bulk.
     :param kwargs:
-        Keyword arguments passed on to the elasticsearch bulk function.
+        Keyword arguments passed on to execute_bulk, see elastic_bulk.
         Default values are read from ctx.conf['bndl_elastic.bulk_*'].
     '''
     index, doc_type = resource_from_conf(self.ctx.conf, index, doc_type)
-    return _elastic_bulk(self.map(lambda doc_id: {
-        '_op_type': 'delete',
-        '_index': index,
-        '_type': doc_type,
-        '_id': doc_id,
-    }), index, doc_type, refresh, hosts, **kwargs)
+    return _elastic_bulk(self, ActionEncoder('delete', index, doc_type), refresh, hosts, **kwargs)
@@ -0,0 +1,125 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Encoding of bulk actions into the newline delimited JSON body of bulk
+requests. Actions are encoded into (action and meta data line, source line)
+pairs of strings; the source line is None for delete actions.
+'''
+
+import json
+
+from elasticsearch.helpers import expand_action
+
+
+class ActionEncoder(object):
+    '''
+    Encodes elements of a dataset as bulk actions of one type on an index and
+    document type without building an action dict per element. The constant
+    part of the action and meta data line is encoded once.
+
+    The elements are expected to be documents for index, (document id,
+    document) pairs for create and update and document ids for delete.
+    '''
+
+    op_types = ('index', 'create', 'update', 'delete')
+
+    def __init__(self, op_type, index=None, doc_type=None, doc_as_upsert=False):
+        if op_type not in self.op_types:
+            raise ValueError('op_type must be one of %s' % ', '.join(self.op_types))
+        self.op_type = op_type
+        self.index = index
+        self.doc_type = doc_type
+        self.doc_as_upsert = doc_as_upsert
+
+
+    def doc_id(self, element):
+        '''
+        The document id of an element (None for index actions).
+        '''
+        if self.op_type == 'index':
+            return None
+        elif self.op_type == 'delete':
+            return element
+        else:
+            return element[0]
+
+
+    def __call__(self, serializer):
+        '''
+        Get a function which encodes a single element with the given
+        serializer.
+        '''
+        dumps = serializer.dumps
+        meta = {key: value for key, value in (('_index', self.index), ('_type', self.doc_type))
+                if value is not None}
+        header = dumps({self.op_type: meta})
+        # the header up to the document id, e.g. {"create":{"_index":"x","_id":
+        prefix = header[:-2] + (',' if meta else '') + '"_id":'
+
+        if self.op_type == 'index':
+            return lambda doc: (header, dumps(doc))
+        elif self.op_type == 'create':
+            return lambda pair: (prefix + json.dumps(pair[0]) + '}}', dumps(pair[1]))
+        elif self.op_type == 'update':
+            suffix = ',"doc_as_upsert":true}' if self.doc_as_upsert else '}'
+            return lambda pair: (prefix + json.dumps(pair[0]) + '}}', '{"doc":' + dumps(pair[1]) + suffix)
+        else:
+            return lambda doc_id: (prefix + json.dumps(doc_id) + '}}', None)
+
+
+
+def encode_action(serializer, action):
+    '''
+    Encode an action in the format of elasticsearch.helpers.bulk.
+    '''
+    header, source = expand_action(action)
+    return serializer.dumps(header), (serializer.dumps(source) if source is not None else None)
+
+
+def chunk_actions(encoded, chunk_size, max_chunk_bytes):
+    '''
+    Group encoded actions into chunks of at most chunk_size actions and
+    max_chunk_bytes bytes (a single action larger than max_chunk_bytes is put
+    in a chunk of its own).
+
+    :param chunk_size: callable
+        Returns the maximum size of the next chunk.
+    '''
+    chunk = []
+    size = 0
+    limit = chunk_size()
+    for header, source in encoded:
+        action_size = len(header) + 1 + (len(source) + 1 if source is not None else 0)
+        if chunk and (len(chunk) >= limit or size + action_size > max_chunk_bytes):
+            yield chunk
+            chunk = []
+            size = 0
+            limit = chunk_size()
+        chunk.append((header, source))
+        size += action_size
+    if chunk:
+        yield chunk
+
+
+def bulk_body(chunk):
+    '''
+    The body of a bulk request for a chunk of encoded actions.
+    '''
+    lines = []
+    append = lines.append
+    for header, source in chunk:
+        append(header)
+        if source is not None:
+            append(source)
+    append('')
+    return '\n'.join(lines)
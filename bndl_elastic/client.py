@@ -10,14 +10,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from collections import Sequence
+from collections.abc import Sequence
 from functools import lru_cache
 from urllib.parse import urlparse
 import contextlib
-import queue
+import re
+import threading
 
 from bndl.net.connection import gethostbyname
-from bndl.util.pool import ObjectPool
+from bndl_elastic.metrics import metrics, MeteredConnection
+from bndl_elastic.pool import ClientPool
+from bndl_elastic.serializers import get_serializer
 from elasticsearch.client import Elasticsearch
 from elasticsearch.connection_pool import ConnectionPool, RoundRobinSelector
 import netifaces
@@ -31,7 +34,6 @@ def resource_from_conf(conf, index=None, doc_type=None):
     return index, doc_type
 
 
-@lru_cache()
 def _get_hosts(ctx, *hosts):
     if not hosts:
         hosts = set()
@@ -48,6 +50,16 @@ def _get_hosts(ctx, *hosts):
 
 
 
+def elastic_version(client):
+    '''
+    The version of the Elastic cluster the client is connected to as tuple
+    of ints, e.g. (5, 1, 1).
+    '''
+    number = client.info()['version']['number']
+    return tuple(int(part) for part in re.findall(r'\d+', number)[:3])
+
+
+
 @lru_cache(1024)
 def parse_hostname(url):
     if url.startswith('inet[/') and url.endswith(']'):
@@ -59,68 +71,135 @@ def parse_hostname(url):
 
 
 class NodeLocalSelectorClass(RoundRobinSelector):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.local_addresses = {
+    '''
+    Selects a connection to a node local Elastic node if available, or a
+    connection in a round robin fashion otherwise.
+
+    Which connections are local is determined once when the selector is
+    created, i.e. when the connection pool is created or recreated after
+    sniffing. NodeLocalConnectionPool keeps the set of live connections of the
+    selector up to date, so selecting a local connection takes constant time.
+    '''
+
+    def __init__(self, opts):
+        super().__init__(opts)
+        local_addresses = {
             addr['addr']
             for af in (netifaces.AF_INET, netifaces.AF_INET6)
             for iface in netifaces.interfaces()
             for addr in netifaces.ifaddresses(iface).get(af, ())
         }
+        self.local_connections = [
+            connection for connection in opts
+            if _resolve(connection.host) in local_addresses
+        ]
+        # the live connections, set by the connection pool
+        self.live = None
 
 
     def select(self, connections):
-        for connection in connections:
-            addr = gethostbyname(parse_hostname(connection.host))
-            if addr in self.local_addresses:
+        live = self.live if self.live is not None else set(connections)
+        for connection in self.local_connections:
+            if connection in live:
                 return connection
         return super().select(connections)
 
 
+
+def _resolve(url):
+    try:
+        return gethostbyname(parse_hostname(url))
+    except OSError:
+        return None
+
+
 class NodeLocalConnectionPool(ConnectionPool):
     def __init__(self, *args, **kwargs):
         assert 'selector_class' not in kwargs
         kwargs['selector_class'] = NodeLocalSelectorClass
         super().__init__(*args, **kwargs)
+        self._update_live()
 
 
+    def _update_live(self):
+        self.selector.live = set(self.connections)
 
-@contextlib.contextmanager
-def elastic_client(ctx, hosts=None):
+
+    def mark_dead(self, connection, now=None):
+        super().mark_dead(connection, now)
+        self._update_live()
+
+
+    def resurrect(self, force=False):
+        # resurrect is called for every request, only update the live
+        # connections if a connection was resurrected
+        connection = super().resurrect(force)
+        if connection is not None:
+            self._update_live()
+        return connection
+
+
+
+_pools_lock = threading.Lock()
+
+
+def _get_pool(ctx, hosts):
     # get hold of the dict of pools (keyed by hosts)
     pools = getattr(elastic_client, 'pools', None)
-    if not pools:
+    if pools is None:
         elastic_client.pools = pools = {}
 
-    # determine contact points, either given or ip addresses of the workers
-    hosts = _get_hosts(ctx, *(hosts or ctx.conf.get('bndl_elastic.hosts') or ()))
-
-    # check if there is a cached client object
+    # check if there is a pool for the hosts or create one if not
     pool = pools.get(hosts)
-    # or create one if not
-    if not pool:
-        timeout = ctx.conf['bndl_elastic.timeout']
-        max_retries = ctx.conf['bndl_elastic.max_retries']
-        retry_on_timeout = ctx.conf['bndl_elastic.retry_on_timeout']
+    if pool:
+        return pool
+    with _pools_lock:
+        pool = pools.get(hosts)
+        if pool:
+            return pool
+
+        conf = ctx.conf
+        timeout = conf['bndl_elastic.timeout']
+        max_retries = conf['bndl_elastic.max_retries']
+        retry_on_timeout = conf['bndl_elastic.retry_on_timeout']
+        serializer = get_serializer(conf['bndl_elastic.serializer'])
+        connections_per_host = conf['bndl_elastic.connections_per_host']
+        tcp_keepalive = conf['bndl_elastic.tcp_keepalive']
         def create():
             return Elasticsearch(
                 hosts,
                 timeout=timeout,
                 max_retries=max_retries,
                 retry_on_timeout=retry_on_timeout,
+                serializer=serializer,
+                maxsize=connections_per_host,
+                tcp_keepalive=tcp_keepalive,
+                connection_class=MeteredConnection,
                 connection_pool_class=NodeLocalConnectionPool
             )
 
-        pools[hosts] = pool = ObjectPool(create, max_size=4)
+        pools[hosts] = pool = ClientPool(
+            create,
+            max_size=conf['bndl_elastic.pool_size'],
+            max_idle=conf['bndl_elastic.pool_max_idle'],
+            wait_timeout=conf['bndl_elastic.pool_wait_timeout'],
+            health_check_interval=conf['bndl_elastic.health_check_interval'],
+        )
+        return pool
+
 
-    # take a session from the pool, yield it to the caller
-    # and put the session back in the pool
-    session = pool.get()
+@contextlib.contextmanager
+def elastic_client(ctx, hosts=None):
+    # determine contact points, either given or ip addresses of the workers
+    hosts = _get_hosts(ctx, *(hosts or ctx.conf.get('bndl_elastic.hosts') or ()))
+    pool = _get_pool(ctx, hosts)
 
+    # take a client from the pool, yield it to the caller
+    # and put the client back in the pool
+    client = pool.get()
+    metrics.pool_stats(hosts, pool.stats())
     try:
-        yield session
+        yield client
     finally:
-        try:
-            pool.put(session)
-        except queue.Full:
-            session.shutdown()
+        pool.put(client)
+        metrics.pool_stats(hosts, pool.stats())
@@ -0,0 +1,150 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Coalescing of bulk actions on the same document within a bounded window of
+documents, so fewer (and smaller) actions are sent to Elastic.
+
+Partial documents of updates are combined with a merge strategy:
+
+- merge: deep merge the partial documents, which is equivalent to applying
+  the updates one after the other (objects are merged, other values
+  including lists are replaced).
+- last: keep only the last partial document (last write wins).
+'''
+
+from collections import OrderedDict
+
+
+def deep_merge(a, b):
+    '''
+    Merge dict b into (a copy of) dict a the way Elastic merges a partial
+    document into a document.
+    '''
+    merged = dict(a)
+    for key, value in b.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = deep_merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def last_write_wins(a, b):
+    return b
+
+
+merge_strategies = {
+    'merge': deep_merge,
+    'last': last_write_wins,
+}
+
+
+_MISSING = object()
+
+
+def _coalesce(items, key, combine, window):
+    '''
+    Combine items with the same key with combine(previous, item) while at
+    most window keys are buffered. If combine returns None, the previous item
+    is emitted and item is buffered instead. Items for which key returns None
+    are passed through.
+    '''
+    buffer = OrderedDict()
+    for item in items:
+        item_key = key(item)
+        if item_key is None:
+            yield item
+            continue
+        previous = buffer.get(item_key, _MISSING)
+        if previous is not _MISSING:
+            combined = combine(previous, item)
+            if combined is not None:
+                buffer[item_key] = combined
+                continue
+            yield buffer.pop(item_key)
+        elif len(buffer) >= window:
+            yield buffer.popitem(last=False)[1]
+        buffer[item_key] = item
+    yield from buffer.values()
+
+
+def _action_key(action):
+    if isinstance(action, dict) and '_id' in action:
+        return action.get('_index'), action.get('_type'), action['_id']
+
+
+def _partial_update(action):
+    return action.get('_op_type') == 'update' and 'doc' in action and 'script' not in action
+
+
+def _combine_actions(merge):
+    '''
+    Combine two actions (in the format of elasticsearch.helpers.bulk) on the
+    same document:
+
+    - a delete or index action supersedes any previous action,
+    - partial updates are merged into a previous partial update or into the
+      _source of a previous index action,
+    - other actions are not combined.
+    '''
+    def combine(previous, action):
+        op_type = action.get('_op_type', 'index')
+        if op_type in ('index', 'delete'):
+            return action
+        if not _partial_update(action):
+            return None
+        if _partial_update(previous):
+            combined = dict(previous, **action)
+            combined['doc'] = merge(previous['doc'], action['doc'])
+            combined['doc_as_upsert'] = previous.get('doc_as_upsert', False) or action.get('doc_as_upsert', False)
+            return combined
+        if previous.get('_op_type', 'index') == 'index' and isinstance(previous.get('_source'), dict):
+            return dict(previous, _source=merge(previous['_source'], action['doc']))
+        return None
+    return combine
+
+
+def coalesced(actions, encoder=None, merge='merge', window=10000):
+    '''
+    Coalesce bulk actions on the same document within a window of documents.
+
+    :param actions: iterable
+        The elements to encode with encoder or the actions in the format of
+        elasticsearch.helpers.bulk if encoder is None.
+    :param encoder: bndl_elastic.bulk_body.ActionEncoder (optional)
+        For update encoders the partial documents per id are merged, for
+        create encoders only the first document per id is kept (later ones
+        would fail) and for delete encoders duplicate ids are dropped.
+    :param merge: str or callable
+        The strategy to merge partial documents: 'merge', 'last' or a
+        function which merges two partial documents.
+    :param window: int
+        The maximum number of documents to buffer.
+    '''
+    if not callable(merge):
+        try:
+            merge = merge_strategies[merge]
+        except KeyError:
+            raise ValueError('Unknown merge strategy %r, expected one of %s'
+                             % (merge, ', '.join(merge_strategies)))
+
+    if encoder is None:
+        return _coalesce(actions, _action_key, _combine_actions(merge), window)
+    elif encoder.op_type == 'update':
+        return _coalesce(actions, encoder.doc_id, lambda previous, pair: (previous[0], merge(previous[1], pair[1])),
+                         window)
+    elif encoder.op_type in ('create', 'delete'):
+        return _coalesce(actions, encoder.doc_id, lambda previous, element: previous, window)
+    else:
+        # index actions have no document id
+        return actions
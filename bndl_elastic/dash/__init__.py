@@ -10,8 +10,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import defaultdict
+import time
+
 from bndl.util import dash
 from bndl.util.exceptions import catch
+from bndl_elastic.metrics import metrics
 from flask.blueprints import Blueprint
 from flask.globals import g
 from flask.templating import render_template
@@ -21,9 +25,61 @@ blueprint = Blueprint('elastic', __name__,
                       template_folder='templates')
 
 
+def _snapshot(*args):
+    return metrics.snapshot()
+
+
+# the total number of seconds to wait for the metrics of the workers
+COLLECT_TIMEOUT = 5
+
+
+def _collect():
+    '''
+    Collect the metrics of this node and of the workers (if any). The workers
+    are requested in parallel, workers which don't respond within
+    COLLECT_TIMEOUT seconds (in total) are left out.
+
+    :return: dict of worker name to metrics snapshot.
+    '''
+    snapshots = {'driver': metrics.snapshot()}
+    ctx = getattr(g, 'ctx', None)
+    requests = []
+    for worker in (ctx.workers if ctx else ()):
+        with catch():
+            requests.append((worker.name, worker.run_task.request(_snapshot)))
+    deadline = time.monotonic() + COLLECT_TIMEOUT
+    for name, request in requests:
+        with catch():
+            snapshots[name] = request.result(timeout=max(0, deadline - time.monotonic()))
+    return snapshots
+
+
+def _per_node(snapshots):
+    '''
+    Sum the metrics per Elastic node and operation over the workers.
+    '''
+    nodes = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    for snapshot in snapshots.values():
+        for node, operations in snapshot['nodes'].items():
+            for operation, values in operations.items():
+                for key, value in values.items():
+                    nodes[node][operation][key] += value
+    return nodes
+
+
 class Status(dash.StatusPanel):
     def render(self):
-        return dash.status.DISABLED, render_template('elastic/status.html')
+        snapshots = _collect()
+        nodes = _per_node(snapshots)
+        requests = sum(values['requests'] for operations in nodes.values() for values in operations.values())
+        errors = sum(values['errors_rate'] for operations in nodes.values() for values in operations.values())
+        if not requests:
+            status = dash.status.DISABLED
+        elif errors:
+            status = dash.status.WARNING
+        else:
+            status = dash.status.OK
+        return status, render_template('elastic/status.html', nodes=nodes, snapshots=snapshots)
 
 
 class Dash(dash.Dash):
@@ -33,4 +89,5 @@ class Dash(dash.Dash):
 
 @blueprint.route('/')
 def index():
-    return render_template('elastic/dashboard.html')
+    snapshots = _collect()
+    return render_template('elastic/dashboard.html', snapshots=snapshots, nodes=_per_node(snapshots))
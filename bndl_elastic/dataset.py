@@ -10,9 +10,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import Counter
+from copy import deepcopy
+from itertools import islice
+from operator import methodcaller
+
 from bndl.compute.dataset import Dataset, Partition, NODE_LOCAL
-from bndl_elastic.client import elastic_client, parse_hostname, resource_from_conf
-from elasticsearch.helpers import scan
+from bndl_elastic.client import elastic_client, elastic_version, parse_hostname, resource_from_conf
+from bndl_elastic.engines import get_engine, prefetch
+from bndl_elastic.hits import Hit
+from bndl_elastic.metrics import metrics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 class ElasticSearchDataset(Dataset):
@@ -20,11 +32,19 @@ class ElasticSearchDataset(Dataset):
     Dataset from an Elastic index.
     
     http://elasticsearch-py.readthedocs.io/en/master/helpers.html#elasticsearch.helpers.scan
-    is used under the covers but scanned on a per shard basis to get data
-    locality.
+    is used under the covers (or point in time with search_after, see the
+    engine argument) but scanned on a per shard basis to get data
+    locality. Shards can be split further into multiple partitions with sliced
+    scroll (requires Elastic 5.0 or later).
+
+    Documents can be read incrementally by giving a watermark field (e.g. a
+    timestamp which is updated on every change or _seq_no) and a checkpoint
+    from a previous read. See ElasticSearchDataset.changed_since.
     '''
 
-    def __init__(self, ctx, index=None, doc_type=None, hosts=None, **kwargs):
+    def __init__(self, ctx, index=None, doc_type=None, hosts=None, slices_per_shard=None,
+                 docs_per_partition=None, watermark=None, since=None, engine=None, prefetch=None,
+                 columns=None, as_arrays=False, compact_hits=None, **kwargs):
         '''
         Create a dataset from an Elastic index.
         
@@ -40,20 +60,322 @@ class ElasticSearchDataset(Dataset):
             The document type name.
         :param hosts: str or iterable (optional)
             Hosts which serve as contact points for the Elastic client.
+        :param slices_per_shard: int (optional)
+            The number of partitions to split each shard into using sliced
+            scroll. Defaults to ctx.conf['bndl_elastic.slices_per_shard'].
+        :param docs_per_partition: int (optional)
+            The target number of documents per partition (0 to disable).
+            Based on the document counts of the (primary) shards, shards with
+            more documents are split into slices (requires Elastic 5.0 or
+            later) and shards with fewer documents are combined into one
+            partition. Defaults to
+            ctx.conf['bndl_elastic.scan_docs_per_partition'].
+        :param watermark: str (optional)
+            Field which increases when a document changes.
+        :param since: dict (optional)
+            Checkpoint as returned by ElasticSearchDataset.checkpoint() of a
+            previous read, only documents changed since are read.
+        :param engine: str or callable (optional)
+            The engine to read the hits of a shard with: scroll, search_after
+            or a callable (see bndl_elastic.engines). Defaults to
+            ctx.conf['bndl_elastic.scan_engine'].
+        :param prefetch: int (optional)
+            The number of pages to read ahead in a background thread (0 to
+            disable). Defaults to ctx.conf['bndl_elastic.scan_prefetch'].
+        :param columns: list of str (optional)
+            Fields to read from doc values (and _id or _index from the hit
+            meta data), the dataset then contains a tuple of the column values
+            per hit instead of the hits.
+        :param as_arrays: bool (optional)
+            If True (and columns are given), the dataset contains a dict of
+            column name to NumPy array per page of hits.
+        :param compact_hits: bool (optional)
+            If True, the dataset contains bndl_elastic.hits.Hit objects
+            instead of dicts, which use less memory and pickle faster when
+            cached or shuffled. Note that this costs CPU time while scanning:
+            the Elastic client has already decoded _source, so it is encoded
+            again (and decoded on access) for every hit. Use it for datasets
+            which are cached or shuffled, not for a single pass. Defaults to
+            ctx.conf['bndl_elastic.scan_compact_hits'].
         :param **kwargs: dict
-            Keyword arguments passed to elasticsearch.helpers.scan.
+            Keyword arguments passed to elasticsearch.helpers.scan (or the
+            engine).
         '''
         super().__init__(ctx)
         index, doc_type = resource_from_conf(ctx.conf, index, doc_type)
         self.index = index
         self.doc_type = doc_type
         self.hosts = hosts
+        if slices_per_shard is None:
+            slices_per_shard = ctx.conf['bndl_elastic.slices_per_shard']
+        self.slices_per_shard = max(1, slices_per_shard)
+        if docs_per_partition is None:
+            docs_per_partition = ctx.conf['bndl_elastic.scan_docs_per_partition']
+        self.docs_per_partition = docs_per_partition
+        self.watermark = watermark
+        self.since = since or {}
+        if engine is None:
+            engine = ctx.conf['bndl_elastic.scan_engine']
+        self.engine = engine
+        if prefetch is None:
+            prefetch = ctx.conf['bndl_elastic.scan_prefetch']
+        self.prefetch = prefetch
+        if compact_hits is None:
+            compact_hits = ctx.conf['bndl_elastic.scan_compact_hits']
+        self.compact_hits = compact_hits
         self.kwargs = kwargs
+        self._watermarks = None
+        self.columns = list(columns) if columns else None
+        self.as_arrays = as_arrays
+        if as_arrays and np is None:
+            raise ValueError('as_arrays requires numpy')
+        if self.columns:
+            body = self._body()
+            body['_source'] = False
+            body['docvalue_fields'] = [column for column in self.columns if column not in _META_COLUMNS]
+            kwargs.pop('q', None)
+            kwargs['query'] = body
+
+
+    def _derive(self, **kwargs):
+        '''
+        Create a new dataset on the same index with the same options, but with
+        the scan keyword arguments updated with kwargs.
+        '''
+        kwargs = {key: value for key, value in dict(self.kwargs, **kwargs).items()
+                  if value is not None}
+        dset = type(self)(self.ctx, self.index, self.doc_type, self.hosts,
+                          slices_per_shard=self.slices_per_shard,
+                          docs_per_partition=self.docs_per_partition,
+                          watermark=self.watermark, since=self.since,
+                          engine=self.engine, prefetch=self.prefetch,
+                          columns=self.columns, as_arrays=self.as_arrays,
+                          compact_hits=self.compact_hits, **kwargs)
+        # the high watermarks don't depend on the query, share them to read
+        # up to the same checkpoint
+        dset._watermarks = self._watermarks
+        return dset
+
+
+    def _body(self):
+        '''
+        A (deep) copy of the search body of this dataset. A query string in q
+        is turned into a query_string query in the body.
+        '''
+        body = deepcopy(self.kwargs.get('query') or {})
+        if self.kwargs.get('q'):
+            query_string = {'query_string': {'query': self.kwargs['q']}}
+            if 'query' in body:
+                body['query'] = {'bool': {'must': [body['query'], query_string]}}
+            else:
+                body['query'] = query_string
+        return body
+
+
+    def select(self, fields, docvalues=False):
+        '''
+        Only fetch the given fields of the documents.
+
+        :param fields: str or list
+            The (source) field(s) to fetch, may contain wildcards.
+        :param docvalues: bool
+            If True the fields are read from doc values (available under
+            'fields' in the hits) instead of from _source. This requires the
+            fields to have doc values.
+        '''
+        if isinstance(fields, str):
+            fields = [fields]
+        body = self._body()
+        if docvalues:
+            body['_source'] = False
+            body['docvalue_fields'] = list(fields)
+        else:
+            body['_source'] = list(fields)
+        return self._derive(query=body, q=None)
+
+
+    def where(self, query):
+        '''
+        Only fetch the documents which match the given query. The query is
+        applied as a filter in addition to the query of this dataset.
+
+        :param query: dict
+            A query in the Elastic query DSL, e.g.
+            ``{'range': {'number': {'gte': 10}}}``.
+        '''
+        return self._derive(query=_filtered(self._body(), query), q=None)
+
+
+    def changed_since(self, watermark, checkpoint=None):
+        '''
+        Only read the documents which changed since a checkpoint.
+
+        The (per shard) maximum of the watermark field is determined when the
+        dataset is first computed, only documents with a watermark up to this
+        maximum are read. Use checkpoint() afterwards to get the checkpoint for
+        the next read, e.g. ``dset = dset.changed_since('ts', dset.checkpoint())``.
+
+        :param watermark: str
+            Field which increases when a document changes, e.g. a timestamp
+            or _seq_no.
+        :param checkpoint: dict (optional)
+            A checkpoint from a previous read. All documents are read if None.
+        '''
+        dset = self._derive()
+        # the high watermarks are determined again for the new read
+        dset.watermark = watermark
+        dset._watermarks = None
+        dset.since = checkpoint or {}
+        return dset
+
+
+    def checkpoint(self):
+        '''
+        The checkpoint up to which documents are read with changed_since; a
+        JSON serializable dict.
+        '''
+        if not self.watermark:
+            raise ValueError('No watermark field set, use changed_since(...)')
+        self.parts()
+        checkpoint = dict(self.since)
+        checkpoint.update((key, high) for key, high in self._watermarks.items() if high is not None)
+        return checkpoint
+
+
+    def _watermark_bounds(self, shards):
+        '''
+        The (low, high) bounds of the watermark of the documents to read per
+        (index, shard). The high watermarks are determined once.
+        '''
+        if self._watermarks is None:
+            watermarks = {}
+            aggs = {'watermark': {'max': {'field': self.watermark}}}
+            with elastic_client(self.ctx, hosts=self.hosts) as client:
+                for index, shard, _ in shards:
+                    resp = client.search(index, self.doc_type, body={'size': 0, 'aggs': aggs},
+                                         preference='_shards:%s' % shard)
+                    watermarks[_shard_key(index, shard)] = resp['aggregations']['watermark']['value']
+            self._watermarks = watermarks
+        return {
+            key: (self.since.get(key), high)
+            for key, high in self._watermarks.items()
+        }
+
+
+    def pluck(self, ind, default=None):
+        # fetching only meta data doesn't require the _source of the documents,
+        # unless the documents are cached
+        keys = ind if isinstance(ind, (list, tuple)) else [ind]
+        if not self.cached and keys and set(keys) <= {'_id', '_index', '_type'}:
+            body = self._body()
+            body['_source'] = False
+            return super(ElasticSearchDataset, self._derive(query=body, q=None)).pluck(ind, default)
+        else:
+            return super().pluck(ind, default)
+
+
+    def _query_kwargs(self):
+        '''
+        The query of this dataset as keyword arguments for the count and search
+        API without any search / scroll specific parts.
+        '''
+        body = self._body()
+        return {'body': {'query': body['query']}} if 'query' in body else {}
+
+
+    def count(self, push_down=None):
+        '''
+        Count the documents matching the query of this dataset. The count is
+        performed server side with the count API instead of scanning, except
+        with as_arrays: the elements (pages of hits) are counted then.
+
+        :param push_down: bool (optional)
+            Whether to count with the count API. Defaults to True unless the
+            dataset is cached (the cached elements are counted then).
+        '''
+        if push_down is None:
+            push_down = not self.cached
+        if not push_down or (self.columns and self.as_arrays):
+            return super().count(push_down=False)
+        if self.watermark:
+            return self._count_incremental()
+        with elastic_client(self.ctx, hosts=self.hosts) as client:
+            resp = client.count(self.index, self.doc_type, **self._query_kwargs())
+        return resp['count']
+
+
+    def _count_incremental(self):
+        # count per shard as the watermark bounds differ per shard
+        count = 0
+        shards = set()
+        with elastic_client(self.ctx, hosts=self.hosts) as client:
+            for part in _shard_partitions(self.parts()):
+                if (part.index, part.shard) in shards:
+                    continue
+                shards.add((part.index, part.shard))
+                body = part._search_body(sliced=False)
+                if body is None:
+                    continue
+                resp = client.count(part.index, self.doc_type, preference='_shards:%s' % part.shard,
+                                    body={'query': body['query']} if 'query' in body else None)
+                count += resp['count']
+        return count
+
+
+    def elastic_aggregate(self, aggs):
+        '''
+        Execute aggregations server side on the documents matching the query
+        of this dataset.
+
+        :param aggs: dict
+            Aggregations in the Elastic query DSL, e.g.
+            ``{'max_price': {'max': {'field': 'price'}}}``.
+        :return: dict
+            The aggregations part of the Elastic response.
+        '''
+        if self.watermark:
+            raise ValueError('Aggregations are not supported when reading changes')
+        kwargs = self._query_kwargs()
+        kwargs['body'] = dict(kwargs.get('body', {}), aggs=aggs, size=0)
+        with elastic_client(self.ctx, hosts=self.hosts) as client:
+            resp = client.search(self.index, self.doc_type, **kwargs)
+        return resp['aggregations']
+
+
+    def field_stats(self, field):
+        '''
+        Compute count, min, max, avg and sum of a numeric field server side.
+
+        :param field: str
+            Name of the field.
+        :return: dict
+            With keys count, min, max, avg and sum.
+        '''
+        return self.elastic_aggregate({'stats': {'stats': {'field': field}}})['stats']
+
+
+    def field_terms(self, field, size=10):
+        '''
+        Compute the most frequent terms of a field server side.
+
+        :param field: str
+            Name of the field.
+        :param size: int
+            The maximum number of terms to return.
+        :return: dict
+            Mapping of term to document count.
+        '''
+        aggs = self.elastic_aggregate({'terms': {'terms': {'field': field, 'size': size}}})
+        return {bucket['key']: bucket['doc_count'] for bucket in aggs['terms']['buckets']}
 
 
     def parts(self):
         with elastic_client(self.ctx, hosts=self.hosts) as client:
             resp = client.search_shards(self.index, self.doc_type)
+            if self.slices_per_shard > 1 or self.docs_per_partition:
+                version = elastic_version(client)
+            if self.docs_per_partition:
+                doc_counts = _doc_counts(client, self.index)
 
         nodes = resp['nodes']
         shards = [
@@ -65,19 +387,200 @@ class ElasticSearchDataset(Dataset):
             for shard in resp['shards']
         ]
 
-        return [
-            ElasticSearchScrollPartition(self, idx, *shard)
-            for idx, shard in enumerate(shards)
-        ]
+        if self.watermark:
+            bounds = self._watermark_bounds(shards)
+        else:
+            bounds = {}
+
+        if self.docs_per_partition:
+            return self._plan(shards, bounds, doc_counts, version)
+
+        if self.slices_per_shard == 1:
+            return [
+                ElasticSearchScrollPartition(self, idx, *shard,
+                                             bounds=bounds.get(_shard_key(*shard[:2])))
+                for idx, shard in enumerate(shards)
+            ]
+
+        shard_counts = Counter(index for index, _, _ in shards)
+        parts = []
+        for index, shard, nodes in shards:
+            for slice_no in range(self.slices_per_shard):
+                slice_id, slice_max = _slice(version, shard, shard_counts[index],
+                                             slice_no, self.slices_per_shard)
+                parts.append(ElasticSearchScrollPartition(self, len(parts), index, shard, nodes,
+                                                          (slice_id, slice_max),
+                                                          bounds.get(_shard_key(index, shard))))
+        return parts
+
+
+    def _plan(self, shards, bounds, doc_counts, version):
+        '''
+        Plan partitions of about docs_per_partition documents: shards with
+        more documents are split into slices, shards with fewer documents are
+        combined (first fit decreasing, ties broken by the nodes which hold the
+        shards).
+        '''
+        target = self.docs_per_partition
+        shard_counts = Counter(index for index, _, _ in shards)
+        parts = []
+        small = []
+
+        for index, shard, nodes in shards:
+            docs = doc_counts.get((index, shard), 0)
+            key = _shard_key(index, shard)
+            if docs < target:
+                small.append((docs, index, shard, nodes))
+                continue
+            slices = max(self.slices_per_shard, -(-docs // target)) if version >= (5,) else 1
+            for slice_no in range(slices):
+                slice = _slice(version, shard, shard_counts[index], slice_no, slices) if slices > 1 else None
+                parts.append(ElasticSearchScrollPartition(self, len(parts), index, shard, nodes,
+                                                          slice, bounds.get(key)))
+
+        bins = []
+        small.sort(key=lambda shard: (-shard[0], sorted(shard[3]), shard[1], shard[2]))
+        for docs, index, shard, nodes in small:
+            for shard_bin in bins:
+                if shard_bin[0] + docs <= target:
+                    break
+            else:
+                shard_bin = [0, []]
+                bins.append(shard_bin)
+            shard_bin[0] += docs
+            shard_bin[1].append((index, shard, nodes))
+
+        for _, members in bins:
+            shard_parts = [
+                ElasticSearchScrollPartition(self, len(parts), index, shard, nodes,
+                                             bounds=bounds.get(_shard_key(index, shard)))
+                for index, shard, nodes in members
+            ]
+            if len(shard_parts) == 1:
+                parts.append(shard_parts[0])
+            else:
+                parts.append(ElasticSearchCombinedPartition(self, len(parts), shard_parts))
+        return parts
+
+
+
+def _doc_counts(client, index):
+    '''
+    The number of documents in the primary shards of the given index (or
+    indices) as dict of (index, shard) to count. Note that nested documents
+    are counted as well.
+    '''
+    resp = client.indices.stats(index=index, metric='docs', level='shards')
+    counts = {}
+    for name, stats in resp['indices'].items():
+        for shard, copies in stats['shards'].items():
+            for copy in copies:
+                if copy['routing']['primary']:
+                    counts[name, int(shard)] = copy.get('docs', {}).get('count', 0)
+    return counts
+
+
+def _shard_partitions(parts):
+    '''
+    Flatten combined partitions into the partitions of the shards.
+    '''
+    for part in parts:
+        if isinstance(part, ElasticSearchCombinedPartition):
+            yield from part.shard_parts
+        else:
+            yield part
+
+
+
+_META_COLUMNS = ('_id', '_index', '_type', '_score')
+
+
+def _rows(hits, columns):
+    '''
+    Yield a tuple of the values of columns for each hit. Only the first value
+    of multi valued fields is taken, missing values are None.
+    '''
+    getters = [
+        methodcaller('get', column) if column in _META_COLUMNS else _field_getter(column)
+        for column in columns
+    ]
+    for hit in hits:
+        yield tuple(getter(hit) for getter in getters)
+
+
+def _field_getter(column):
+    def get(hit):
+        values = hit.get('fields', {}).get(column)
+        return values[0] if values else None
+    return get
+
+
+def _column_batches(rows, columns, batch_size):
+    '''
+    Yield dicts of column name to NumPy array for batches of rows. Missing
+    values are NaN in numeric columns, otherwise None (in an object array).
+    '''
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        yield {
+            column: _array(values)
+            for column, values in zip(columns, zip(*batch))
+        }
+
+
+def _array(values):
+    if None in values:
+        present = [value for value in values if value is not None]
+        if present and all(isinstance(value, (int, float)) and not isinstance(value, bool)
+                           for value in present):
+            return np.array([np.nan if value is None else value for value in values], dtype=float)
+        return np.array(values, dtype=object)
+    return np.array(values)
+
+
+def _shard_key(index, shard):
+    return '%s/%s' % (index, shard)
+
+
+def _filtered(body, query):
+    '''
+    Add query as filter to the query in the search body.
+    '''
+    if 'query' in body:
+        body['query'] = {'bool': {'must': [body['query']], 'filter': [query]}}
+    else:
+        body['query'] = {'bool': {'filter': [query]}}
+    return body
+
+
+
+def _slice(version, shard, num_shards, slice_no, slices_per_shard):
+    '''
+    Compute the slice id and max for the slice_no-th slice of a shard when
+    scrolling with preference _shards:<shard>.
+
+    As of Elastic 6.4 slices are computed relative to the shards selected by
+    the preference, before that relative to all shards of the index. In the
+    latter case slice ids must map onto the shard (id % num_shards == shard).
+    '''
+    if version >= (6, 4):
+        return slice_no, slices_per_shard
+    else:
+        return shard + slice_no * num_shards, slices_per_shard * num_shards
 
 
 
 class ElasticSearchScrollPartition(Partition):
-    def __init__(self, dset, idx, index, shard, nodes):
+    def __init__(self, dset, idx, index, shard, nodes, slice=None, bounds=None):
         super().__init__(dset, idx)
         self.index = index
         self.shard = shard
         self.nodes = set(nodes)
+        self.slice = slice
+        self.bounds = bounds
 
 
     def _locality(self, workers):
@@ -86,12 +589,96 @@ class ElasticSearchScrollPartition(Partition):
                 yield worker, NODE_LOCAL
 
 
+    def _search_body(self, sliced=True):
+        '''
+        The search body for this partition, or None if there is nothing to
+        read (when reading incrementally).
+        '''
+        body = self.dset._body()
+        if self.slice and sliced:
+            slice_id, slice_max = self.slice
+            body['slice'] = {'id': slice_id, 'max': slice_max}
+        if self.bounds:
+            low, high = self.bounds
+            if high is None or (low is not None and low >= high):
+                return None
+            watermark = {'lte': high}
+            if low is not None:
+                watermark['gt'] = low
+            body = _filtered(body, {'range': {self.dset.watermark: watermark}})
+        return body
+
+
     def _compute(self):
+        body = self._search_body()
+        if body is None:
+            return
+        kwargs = dict(self.dset.kwargs)
+        kwargs.pop('q', None)
+        if body:
+            kwargs['query'] = body
+
+        engine = get_engine(self.dset.engine)
         with elastic_client(self.dset.ctx, hosts=self.dset.hosts) as client:
-            yield from scan(
+            hits = engine(
                 client,
                 index=self.index,
                 doc_type=self.dset.doc_type,
                 preference='_shards:%s' % self.shard,
-                **self.dset.kwargs
+                **kwargs
             )
+            if self.dset.prefetch > 0:
+                hits = prefetch(hits, self.dset.prefetch, kwargs.get('size', 1000))
+            hits = _metered(hits)
+            columns = self.dset.columns
+            if columns and self.dset.as_arrays:
+                yield from _column_batches(_rows(hits, columns), columns, kwargs.get('size', 1000))
+            elif columns:
+                yield from _rows(hits, columns)
+            elif self.dset.compact_hits:
+                yield from map(Hit.from_dict, hits)
+            else:
+                yield from hits
+
+
+
+class ElasticSearchCombinedPartition(Partition):
+    '''
+    Partition which reads (small) shards one after the other.
+    '''
+
+    def __init__(self, dset, idx, shard_parts):
+        super().__init__(dset, idx)
+        self.shard_parts = shard_parts
+        self.nodes = set().union(*(part.nodes for part in shard_parts))
+
+
+    def _locality(self, workers):
+        for worker in workers:
+            if worker.ip_addresses() & self.nodes:
+                yield worker, NODE_LOCAL
+
+
+    def _compute(self):
+        for part in self.shard_parts:
+            yield from part._compute()
+
+
+
+def _metered(hits, batch=1000):
+    '''
+    Yield the hits from a scan while recording the number of hits and open
+    scroll contexts in bndl_elastic.metrics.metrics.
+    '''
+    metrics.scroll_opened()
+    count = 0
+    try:
+        for hit in hits:
+            yield hit
+            count += 1
+            if count == batch:
+                metrics.docs_processed('scan', count)
+                count = 0
+    finally:
+        metrics.docs_processed('scan', count)
+        metrics.scroll_closed()
@@ -0,0 +1,185 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Engines to read the hits of a (shard of an) index. An engine is a callable
+which takes the client, index, doc_type, preference, the search body as query
+and further keyword arguments and yields the hits.
+'''
+
+import logging
+import queue
+import threading
+import time
+
+from bndl_elastic.client import elastic_version
+from elasticsearch.exceptions import ConnectionError, TransportError
+from elasticsearch.helpers import scan
+
+
+logger = logging.getLogger(__name__)
+
+
+def scroll(client, index, doc_type, preference, query=None, **kwargs):
+    '''
+    Read hits with the scroll API through elasticsearch.helpers.scan.
+    '''
+    return scan(client, index=index, doc_type=doc_type, preference=preference, query=query, **kwargs)
+
+
+# keyword arguments of elasticsearch.helpers.scan which don't apply to search_after
+_SCROLL_KWARGS = ('scroll', 'preserve_order', 'clear_scroll', 'raise_on_error', 'scroll_kwargs')
+
+
+def _retryable(exc):
+    return isinstance(exc, ConnectionError) or exc.status_code in (429, 502, 503, 504)
+
+
+def search_after(client, index, doc_type, preference, query=None, size=1000, keep_alive='5m',
+                 max_retries=3, **kwargs):
+    '''
+    Read hits with a point in time and search_after (requires Elastic 7.10
+    or later). Hits are sorted on _shard_doc, or on _doc before Elastic 7.12
+    (which is unique as each partition reads a single shard).
+
+    No scroll context is kept open between pages and requests for a page
+    which fail with a connection error or a 429, 502, 503 or 504 status are
+    retried from the last sort key (with exponential backoff) instead of
+    failing the partition.
+
+    :param size: int
+        The number of hits per page.
+    :param keep_alive: str
+        How long the point in time is kept alive between requests.
+    :param max_retries: int
+        The maximum number of retries per page.
+    '''
+    for key in _SCROLL_KWARGS:
+        kwargs.pop(key, None)
+
+    resp = client.transport.perform_request('POST', '/%s/_pit' % index, params={
+        'keep_alive': keep_alive,
+        'preference': preference,
+    })
+    pit_id = resp['id']
+
+    body = dict(query or {})
+    body['size'] = size
+    body['sort'] = [{'_shard_doc' if elastic_version(client) >= (7, 12) else '_doc': 'asc'}]
+    body['pit'] = {'id': pit_id, 'keep_alive': keep_alive}
+
+    try:
+        while True:
+            for attempt in range(max_retries + 1):
+                try:
+                    resp = client.search(body=body, **kwargs)
+                    break
+                except TransportError as exc:
+                    if attempt == max_retries or not _retryable(exc):
+                        raise
+                    backoff = 2 ** attempt
+                    logger.info('Retrying page of %s from %s in %s seconds after %s',
+                                index, body.get('search_after'), backoff, exc)
+                    time.sleep(backoff)
+
+            pit_id = body['pit']['id'] = resp.get('pit_id', pit_id)
+            hits = resp['hits']['hits']
+            yield from hits
+            if len(hits) < size:
+                break
+            body['search_after'] = hits[-1]['sort']
+    finally:
+        try:
+            client.transport.perform_request('DELETE', '/_pit', body={'id': pit_id})
+        except TransportError:
+            logger.warning('Unable to close point in time of %s', index, exc_info=True)
+
+
+def prefetch(hits, pages, page_size=1000):
+    '''
+    Read hits in a background thread, keeping at most pages pages of
+    page_size hits buffered, so requests to Elastic overlap with the
+    processing of the hits by the consumer.
+
+    :param hits: iterable
+        The hits, e.g. as yielded by an engine.
+    :param pages: int
+        The maximum number of pages to read ahead.
+    :param page_size: int
+        The number of hits per page.
+    '''
+    buffer = queue.Queue(pages)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        it = iter(hits)
+        try:
+            page = []
+            for hit in it:
+                page.append(hit)
+                if len(page) == page_size:
+                    if not put(page):
+                        return
+                    page = []
+            if page and not put(page):
+                return
+            put(done)
+        except Exception as exc:
+            put(exc)
+        finally:
+            close = getattr(it, 'close', None)
+            if close:
+                close()
+
+    producer = threading.Thread(target=produce, name='bndl_elastic-prefetch', daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            page = buffer.get()
+            if page is done:
+                break
+            elif isinstance(page, Exception):
+                raise page
+            yield from page
+    finally:
+        stop.set()
+        producer.join()
+
+
+engines = {
+    'scroll': scroll,
+    'search_after': search_after,
+}
+
+
+def get_engine(engine):
+    '''
+    Get an engine by name (scroll or search_after) or return engine if it is
+    callable.
+    '''
+    if callable(engine):
+        return engine
+    try:
+        return engines[engine]
+    except KeyError:
+        raise ValueError('Unknown engine %r, expected one of %s' % (engine, ', '.join(engines)))
@@ -0,0 +1,143 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sys
+
+from bndl_elastic.serializers import orjson
+
+
+if orjson:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    def _dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    _loads = json.loads
+
+
+class Hit(object):
+    '''
+    Compact representation of a search hit. The index and doc type strings
+    are interned and _source is kept as JSON encoded bytes which are decoded
+    on first access, so hits take less memory and pickle faster than dicts.
+    As the Elastic client returns hits with a decoded _source, from_dict
+    encodes _source again; this is paid once per hit, the savings apply each
+    time the hit is kept or pickled.
+
+    Hits support the item access of the dicts from Elastic, e.g.
+    ``hit['_id']`` and ``hit['_source']``. The keys of the dict are kept, also
+    when their value is None (e.g. _score of scan hits).
+    '''
+
+    __slots__ = ('id', 'index', 'type', 'score', 'fields', 'sort', '_raw_source', '_decoded_source', '_present')
+
+    _keys = {
+        '_id': 'id',
+        '_index': 'index',
+        '_type': 'type',
+        '_score': 'score',
+        '_source': 'source',
+        'fields': 'fields',
+        'sort': 'sort',
+    }
+
+    # bit per key in _present
+    _bits = {key: 1 << idx for idx, key in enumerate(_keys)}
+
+    def __init__(self, id, index, type=None, score=None, raw_source=None, fields=None, sort=None, keys=None):
+        '''
+        :param keys: iterable (optional)
+            The keys of the hit (dict), if not given the keys with a value
+            which isn't None.
+        '''
+        self.id = id
+        self.index = sys.intern(index) if index else index
+        self.type = sys.intern(type) if type else type
+        self.score = score
+        self.fields = fields
+        self.sort = sort
+        self._raw_source = raw_source
+        self._decoded_source = None
+        if keys is None:
+            keys = (key for key, attr in self._keys.items() if getattr(self, attr) is not None)
+        self._present = sum(self._bits[key] for key in keys if key in self._bits)
+
+
+    @classmethod
+    def from_dict(cls, hit):
+        source = hit.get('_source')
+        return cls(hit.get('_id'), hit.get('_index'), hit.get('_type'), hit.get('_score'),
+                   _dumps(source) if source is not None else None,
+                   hit.get('fields'), hit.get('sort'), keys=hit.keys())
+
+
+    @property
+    def source(self):
+        if self._decoded_source is None and self._raw_source is not None:
+            self._decoded_source = _loads(self._raw_source)
+        return self._decoded_source
+
+
+    def to_dict(self):
+        return {key: getattr(self, attr) for key, attr in self._keys.items() if self._present & self._bits[key]}
+
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, self._keys[key])
+
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+    def __contains__(self, key):
+        return bool(self._present & self._bits.get(key, 0))
+
+
+    def keys(self):
+        return self.to_dict().keys()
+
+
+    def __eq__(self, other):
+        if isinstance(other, Hit):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+
+    def __hash__(self):
+        return hash((self.index, self.type, self.id))
+
+
+    def __getstate__(self):
+        # pickle the encoded source unless it was decoded (and possibly changed)
+        source = self._decoded_source if self._decoded_source is not None else self._raw_source
+        return (self.id, self.index, self.type, self.score, self.fields, self.sort, source, self._present)
+
+
+    def __setstate__(self, state):
+        self.id, index, type, self.score, self.fields, self.sort, source, self._present = state
+        self.index = sys.intern(index) if index else index
+        self.type = sys.intern(type) if type else type
+        if isinstance(source, bytes):
+            self._raw_source, self._decoded_source = source, None
+        else:
+            self._raw_source, self._decoded_source = None, source
+
+
+    def __repr__(self):
+        return '<Hit %s/%s/%s>' % (self.index, self.type, self.id)
@@ -0,0 +1,272 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+from itertools import islice
+import threading
+import uuid
+
+from bndl_elastic.bulk import _pipeline
+from bndl_elastic.client import elastic_client, resource_from_conf
+from bndl_elastic.metrics import metrics
+from elasticsearch.exceptions import TransportError
+
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    '''
+    Thread safe cache which holds the max_size most recently used entries.
+    '''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+
+# the caches of this process keyed by the id of a lookup, as [cache, number
+# of partitions using the cache] lists
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+@contextmanager
+def _cache(key, max_size):
+    '''
+    The cache for the lookup with the given key, shared by the partitions of
+    the lookup which are computed concurrently in this process. The cache is
+    dropped when no partition uses it anymore, so every execution of a lookup
+    starts with an empty cache.
+    '''
+    with _caches_lock:
+        entry = _caches.get(key)
+        if entry is None:
+            _caches[key] = entry = [LRUCache(max_size), 0]
+        entry[1] += 1
+    try:
+        yield entry[0]
+    finally:
+        with _caches_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _caches[key]
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _lookup_batch(client, index, doc_type, key, fields, cache, records):
+    '''
+    Look up the documents for a batch of records, the documents not in cache
+    are fetched with a single mget request.
+    '''
+    keys = [str(key(record) if key else record) for record in records]
+    docs = {}
+    missing = []
+    for doc_id in dict.fromkeys(keys):
+        doc = cache.get(doc_id, _MISSING) if cache is not None else _MISSING
+        if doc is _MISSING:
+            missing.append(doc_id)
+        else:
+            docs[doc_id] = doc
+
+    if missing:
+        kwargs = {'_source': list(fields)} if fields else {}
+        resp = client.mget(body={'ids': missing}, index=index, doc_type=doc_type, **kwargs)
+        for doc_id, doc in zip(missing, resp['docs']):
+            source = doc.get('_source') if doc.get('found') else None
+            docs[doc_id] = source
+            if cache is not None:
+                cache.put(doc_id, source)
+
+    metrics.docs_processed('lookup', len(records))
+    return [(record, docs[doc_id]) for record, doc_id in zip(records, keys)]
+
+
+def _lookup_partition(ctx, index, doc_type, key, fields, batch_size, concurrency, cache_size, hosts, cache_id,
+                      records):
+    if cache_size:
+        with _cache(cache_id, cache_size) as cache:
+            yield from _lookup_records(ctx, index, doc_type, key, fields, batch_size, concurrency, hosts, cache,
+                                       records)
+    else:
+        yield from _lookup_records(ctx, index, doc_type, key, fields, batch_size, concurrency, hosts, None, records)
+
+
+def _lookup_records(ctx, index, doc_type, key, fields, batch_size, concurrency, hosts, cache, records):
+    with elastic_client(ctx, hosts=hosts) as client:
+        lookup = partial(_lookup_batch, client, index, doc_type, key, fields, cache)
+        for batch in _pipeline(_batches(records, batch_size), concurrency, lookup, ordered=True):
+            yield from batch
+
+
+def elastic_lookup(self, index=None, doc_type=None, key=None, fields=None, batch_size=None, concurrency=None,
+                   cache_size=None, hosts=None):
+    '''
+    Look up a document by id for each element of the dataset. Ids are looked
+    up in batches with mget requests (with duplicate ids per batch removed)
+    and the documents are cached per worker while the partitions of the
+    lookup are computed.
+
+    :param index: str (optional)
+        The index name.
+    :param doc_type: str (optional)
+        The document type name.
+    :param key: callable (optional)
+        Function which returns the document id for an element, if not set the
+        elements are the document ids.
+    :param fields: list of str (optional)
+        The (source) fields to fetch, all fields are fetched if not set.
+    :param batch_size: int (optional)
+        The number of elements per mget request. Defaults to
+        ctx.conf['bndl_elastic.lookup_batch_size'].
+    :param concurrency: int (optional)
+        The maximum number of mget requests in flight per partition. Defaults
+        to ctx.conf['bndl_elastic.lookup_concurrency'].
+    :param cache_size: int (optional)
+        The number of documents to cache per worker (0 to disable). Defaults
+        to ctx.conf['bndl_elastic.lookup_cache_size']. Note that cached
+        documents are shared between elements, don't modify them in place.
+    :param hosts: str or iterable (optional)
+        Hosts which serve as contact points for the Elastic client.
+    :return: Dataset
+        A dataset of (element, document source) pairs, the source is None if
+        the document wasn't found.
+    '''
+    conf = self.ctx.conf
+    index, doc_type = resource_from_conf(conf, index, doc_type)
+    if batch_size is None:
+        batch_size = conf['bndl_elastic.lookup_batch_size']
+    if concurrency is None:
+        concurrency = conf['bndl_elastic.lookup_concurrency']
+    if cache_size is None:
+        cache_size = conf['bndl_elastic.lookup_cache_size']
+    if fields is not None:
+        fields = (fields,) if isinstance(fields, str) else tuple(fields)
+    return self.map_partitions(partial(_lookup_partition, self.ctx, index, doc_type, key, fields,
+                                       batch_size, concurrency, cache_size, hosts, uuid.uuid4().hex))
+
+
+def _msearch_batch(client, header, query_fn, size, raise_on_error, records):
+    '''
+    Execute the queries for a batch of records with a single msearch request.
+    '''
+    dumps = client.transport.serializer.dumps
+    lines = []
+    queried = []
+    for idx, record in enumerate(records):
+        body = query_fn(record)
+        if body is None:
+            continue
+        body = dict(body)
+        body.setdefault('size', size)
+        lines.append(header)
+        lines.append(dumps(body))
+        queried.append(idx)
+
+    results = [(record, []) for record in records]
+    if queried:
+        lines.append('')
+        resp = client.msearch(body='\n'.join(lines))
+        for idx, result in zip(queried, resp['responses']):
+            if 'error' in result:
+                if raise_on_error:
+                    raise TransportError(result.get('status', 'N/A'), result['error'], result)
+                results[idx] = (records[idx], None)
+            else:
+                results[idx] = (records[idx], result['hits']['hits'])
+
+    metrics.docs_processed('msearch', len(records))
+    return results
+
+
+def _msearch_partition(ctx, index, doc_type, query_fn, size, batch_size, concurrency, raise_on_error, hosts,
+                       records):
+    with elastic_client(ctx, hosts=hosts) as client:
+        meta = {key: value for key, value in (('index', index), ('type', doc_type)) if value is not None}
+        header = client.transport.serializer.dumps(meta)
+        search = partial(_msearch_batch, client, header, query_fn, size, raise_on_error)
+        for batch in _pipeline(_batches(records, batch_size), concurrency, search, ordered=True):
+            yield from batch
+
+
+def elastic_msearch(self, index=None, query_fn=None, size=10, doc_type=None, batch_size=None, concurrency=None,
+                    raise_on_error=True, hosts=None):
+    '''
+    Execute a query for each element of the dataset. The queries are sent in
+    batches with msearch requests.
+
+    :param index: str (optional)
+        The index name.
+    :param query_fn: callable
+        Function which returns the search body (e.g. ``{'query': ...}``) for
+        an element, or None to not query for the element.
+    :param size: int (optional)
+        The number of hits per query (unless set in the search body).
+    :param doc_type: str (optional)
+        The document type name.
+    :param batch_size: int (optional)
+        The number of queries per msearch request. Defaults to
+        ctx.conf['bndl_elastic.msearch_batch_size'].
+    :param concurrency: int (optional)
+        The maximum number of msearch requests in flight per partition.
+        Defaults to ctx.conf['bndl_elastic.msearch_concurrency'].
+    :param raise_on_error: bool (optional)
+        Whether to raise a TransportError if a query fails, or to yield None
+        as hits for the element.
+    :param hosts: str or iterable (optional)
+        Hosts which serve as contact points for the Elastic client.
+    :return: Dataset
+        A dataset of (element, hits) pairs.
+    '''
+    if query_fn is None:
+        raise ValueError('query_fn is required')
+    conf = self.ctx.conf
+    index, doc_type = resource_from_conf(conf, index, doc_type)
+    if batch_size is None:
+        batch_size = conf['bndl_elastic.msearch_batch_size']
+    if concurrency is None:
+        concurrency = conf['bndl_elastic.msearch_concurrency']
+    return self.map_partitions(partial(_msearch_partition, self.ctx, index, doc_type, query_fn, size,
+                                       batch_size, concurrency, raise_on_error, hosts))
@@ -0,0 +1,192 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import defaultdict, deque
+import socket
+import threading
+import time
+
+from elasticsearch.connection import Urllib3HttpConnection
+from urllib3.connection import HTTPConnection
+
+
+class Meter(object):
+    '''
+    A cumulative count with a rate over a sliding window (in seconds).
+    '''
+
+    def __init__(self, window=10):
+        self.window = window
+        self.total = 0
+        self._counts = deque()
+
+
+    def mark(self, n=1):
+        now = int(time.monotonic())
+        self.total += n
+        if self._counts and self._counts[-1][0] == now:
+            self._counts[-1][1] += n
+        else:
+            self._counts.append([now, n])
+        self._trim(now)
+
+
+    def _trim(self, now):
+        while self._counts and self._counts[0][0] <= now - self.window:
+            self._counts.popleft()
+
+
+    def rate(self):
+        self._trim(int(time.monotonic()))
+        return sum(count for _, count in self._counts) / self.window
+
+
+
+class _NodeMetrics(object):
+    def __init__(self):
+        self.requests = Meter()
+        self.errors = Meter()
+        self.bytes_sent = Meter()
+        self.bytes_received = Meter()
+        self.in_flight = 0
+
+
+
+class ElasticMetrics(object):
+    '''
+    Process local metrics of the interaction with Elastic: requests, bytes
+    and errors per Elastic node and operation, documents per operation, open
+    scroll contexts and utilization of the client pools.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.nodes = defaultdict(_NodeMetrics)
+        self.docs = defaultdict(Meter)
+        self.scrolls = 0
+        self.pools = {}
+
+
+    def request_started(self, node, operation):
+        with self._lock:
+            self.nodes[node, operation].in_flight += 1
+
+
+    def request_finished(self, node, operation, sent, received, failed=False):
+        with self._lock:
+            metrics = self.nodes[node, operation]
+            metrics.in_flight -= 1
+            metrics.requests.mark()
+            metrics.bytes_sent.mark(sent)
+            metrics.bytes_received.mark(received)
+            if failed:
+                metrics.errors.mark()
+
+
+    def docs_processed(self, operation, count):
+        with self._lock:
+            self.docs[operation].mark(count)
+
+
+    def scroll_opened(self):
+        with self._lock:
+            self.scrolls += 1
+
+
+    def scroll_closed(self):
+        with self._lock:
+            self.scrolls -= 1
+
+
+    def pool_stats(self, hosts, stats):
+        with self._lock:
+            self.pools[','.join(hosts)] = stats
+
+
+    def snapshot(self):
+        '''
+        A picklable snapshot of the metrics.
+        '''
+        with self._lock:
+            nodes = defaultdict(dict)
+            for (node, operation), metrics in self.nodes.items():
+                nodes[node][operation] = dict(
+                    requests=metrics.requests.total,
+                    requests_rate=metrics.requests.rate(),
+                    errors=metrics.errors.total,
+                    errors_rate=metrics.errors.rate(),
+                    bytes_sent=metrics.bytes_sent.total,
+                    bytes_sent_rate=metrics.bytes_sent.rate(),
+                    bytes_received=metrics.bytes_received.total,
+                    bytes_received_rate=metrics.bytes_received.rate(),
+                    in_flight=metrics.in_flight,
+                )
+            return dict(
+                nodes=dict(nodes),
+                docs={
+                    operation: dict(total=meter.total, rate=meter.rate())
+                    for operation, meter in self.docs.items()
+                },
+                scrolls=self.scrolls,
+                pools=dict(self.pools),
+            )
+
+
+metrics = ElasticMetrics()
+
+
+
+def _operation(url):
+    if '_bulk' in url:
+        return 'bulk'
+    elif '_search' in url:
+        return 'scan'
+    else:
+        return 'other'
+
+
+def _size(body):
+    return len(body) if isinstance(body, (str, bytes)) else 0
+
+
+
+class MeteredConnection(Urllib3HttpConnection):
+    '''
+    Connection which records requests, bytes and errors in
+    bndl_elastic.metrics.metrics.
+
+    :param tcp_keepalive: bool
+        Whether to enable TCP keep-alive on the sockets of the connection, so
+        idle connections aren't dropped (silently) by e.g. firewalls.
+    '''
+
+    def __init__(self, *args, tcp_keepalive=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        if tcp_keepalive:
+            self.pool.conn_kw['socket_options'] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+            ]
+
+
+    def perform_request(self, method, url, *args, **kwargs):
+        body = kwargs['body'] if 'body' in kwargs else (args[1] if len(args) > 1 else None)
+        operation = _operation(url)
+        metrics.request_started(self.host, operation)
+        received = 0
+        failed = True
+        try:
+            status, headers, data = super().perform_request(method, url, *args, **kwargs)
+            received = _size(data)
+            failed = False
+            return status, headers, data
+        finally:
+            metrics.request_finished(self.host, operation, _size(body), received, failed)
@@ -0,0 +1,196 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+
+from elasticsearch.exceptions import TransportError
+
+
+logger = logging.getLogger(__name__)
+
+
+class ClientPool(object):
+    '''
+    Pool of at most max_size Elastic clients.
+
+    Clients are taken from the pool with get() and returned with put(). A
+    thread which already holds a client gets the same client again (so nested
+    use doesn't exhaust the pool). If all clients are in use, get() waits at
+    most wait_timeout seconds for a client to be returned; after that the
+    least used client is shared (Elastic clients are thread safe).
+
+    Clients which are idle for longer than max_idle seconds are closed. The
+    nodes of a client are health checked (at most every health_check_interval
+    seconds) when it's taken from the pool; nodes which don't respond are
+    marked dead in the connection pool of the client, which removes them until
+    they are resurrected.
+    '''
+
+    def __init__(self, create, max_size=4, max_idle=300, wait_timeout=1, health_check_interval=60):
+        self.create = create
+        self.max_size = max(1, max_size)
+        self.max_idle = max_idle
+        self.wait_timeout = wait_timeout
+        self.health_check_interval = health_check_interval
+        self._cond = threading.Condition()
+        # idle clients as (client, time returned) pairs, most recently used last
+        self._idle = []
+        # client to the number of holds
+        self._in_use = {}
+        # (thread id, client) to the depth of the hold
+        self._held = {}
+        # thread id to the client the thread holds
+        self._holders = {}
+        self._checked = {}
+        self._creating = 0
+        self.hits = 0
+        self.waits = 0
+        self.shares = 0
+        self.creations = 0
+        self.evictions = 0
+        self.dead_nodes = 0
+
+
+    @property
+    def size(self):
+        return len(self._idle) + len(self._in_use) + self._creating
+
+
+    def get(self):
+        thread = threading.get_ident()
+        with self._cond:
+            held = self._holders.get(thread)
+            if held is not None:
+                self._held[thread, held] += 1
+                return held
+
+            self._evict()
+            client = None
+            if not self._idle and self.size >= self.max_size:
+                self.waits += 1
+                self._cond.wait_for(lambda: self._idle, self.wait_timeout)
+            if self._idle:
+                client = self._idle.pop()[0]
+                self.hits += 1
+            elif self.size < self.max_size:
+                self._creating += 1
+            else:
+                client = min(self._in_use, key=self._in_use.get)
+                self.shares += 1
+
+        if client is None:
+            try:
+                client = self.create()
+            finally:
+                with self._cond:
+                    self._creating -= 1
+            with self._cond:
+                self.creations += 1
+        else:
+            self._health_check(client)
+
+        with self._cond:
+            self._in_use[client] = self._in_use.get(client, 0) + 1
+            self._held[thread, client] = 1
+            self._holders[thread] = client
+        return client
+
+
+    def put(self, client):
+        '''
+        Return a client to the pool. The client is released from the hold of
+        the calling thread or, if the calling thread doesn't hold the client
+        (e.g. a generator closed in another thread), from the hold of another
+        thread.
+        '''
+        with self._cond:
+            hold = (threading.get_ident(), client)
+            if hold not in self._held:
+                hold = next((key for key in self._held if key[1] is client), None)
+                if hold is None:
+                    raise ValueError('Client %r is not held' % client)
+            if self._held[hold] > 1:
+                self._held[hold] -= 1
+                return
+            del self._held[hold]
+            if self._holders.get(hold[0]) is client:
+                del self._holders[hold[0]]
+            self._in_use[client] -= 1
+            if not self._in_use[client]:
+                del self._in_use[client]
+                self._idle.append((client, time.monotonic()))
+                self._cond.notify()
+            self._evict()
+
+
+    def _evict(self):
+        if not self.max_idle:
+            return
+        deadline = time.monotonic() - self.max_idle
+        while self._idle and self._idle[0][1] < deadline:
+            client, _ = self._idle.pop(0)
+            self._checked.pop(client, None)
+            self.evictions += 1
+            _close(client)
+
+
+    def _health_check(self, client):
+        if not self.health_check_interval:
+            return
+        now = time.monotonic()
+        if now - self._checked.get(client, now - self.health_check_interval) < self.health_check_interval:
+            return
+        self._checked[client] = now
+        pool = client.transport.connection_pool
+        for connection in list(getattr(pool, 'connections', ())):
+            try:
+                connection.perform_request('HEAD', '/', timeout=5)
+            except TransportError as exc:
+                logger.warning('Elastic node %s failed health check, marking it dead: %s', connection.host, exc)
+                self.dead_nodes += 1
+                pool.mark_dead(connection)
+
+
+    def close(self):
+        '''
+        Close the idle clients.
+        '''
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for client, _ in idle:
+            _close(client)
+
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                size=self.size,
+                max_size=self.max_size,
+                in_use=len(self._in_use),
+                idle=len(self._idle),
+                hits=self.hits,
+                waits=self.waits,
+                shares=self.shares,
+                creations=self.creations,
+                evictions=self.evictions,
+                dead_nodes=self.dead_nodes,
+            )
+
+
+
+def _close(client):
+    try:
+        client.transport.close()
+    except Exception:
+        logger.debug('Unable to close Elastic client', exc_info=True)
@@ -0,0 +1,146 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Copying an index into a new index through a (transforming) dataset.
+'''
+
+import logging
+
+from bndl_elastic.client import elastic_client, elastic_version
+from elasticsearch.exceptions import NotFoundError
+
+
+logger = logging.getLogger(__name__)
+
+
+# settings of the source index which are copied to the target index
+_COPIED_SETTINGS = ('number_of_shards', 'number_of_replicas', 'refresh_interval', 'analysis')
+
+
+def _target_settings(source, settings):
+    '''
+    The settings of the target index: the copied settings of the source index
+    updated with the given settings.
+    '''
+    target = {key: source[key] for key in _COPIED_SETTINGS if key in source}
+    target.update(settings or {})
+    target.setdefault('number_of_replicas', 1)
+    target.setdefault('refresh_interval', '1s')
+    return target
+
+
+def _action(dst, doc_type, transform, hit):
+    doc = transform(hit['_source']) if transform else hit['_source']
+    if doc is None:
+        return None
+    action = {'_index': dst, '_id': hit['_id'], '_source': doc}
+    if doc_type:
+        action['_type'] = doc_type
+    return action
+
+
+def _swap_alias(client, alias, index):
+    '''
+    Point alias to index (only) in a single atomic update.
+    '''
+    try:
+        current = client.indices.get_alias(name=alias)
+    except NotFoundError:
+        current = {}
+    actions = [{'remove': {'index': name, 'alias': alias}} for name in current if name != index]
+    actions.append({'add': {'index': index, 'alias': alias}})
+    client.indices.update_aliases(body={'actions': actions})
+
+
+def elastic_reindex(self, src, dst, transform=None, alias=None, doc_type=None, query=None, settings=None,
+                    force_merge=False, hosts=None, slices_per_shard=None, **kwargs):
+    '''
+    Copy the documents of an index into a new index.
+
+    The target index is created with the mappings and (a subset of the)
+    settings of the source index, but with refresh disabled and without
+    replicas while writing. Afterwards the number of replicas and refresh
+    interval are restored, the index is optionally force merged and
+    refreshed and an alias is (atomically) moved to the target index.
+
+    :param ctx: bndl.compute.context.ComputeContext
+        Can be ignored when using ComputeContext.elastic_reindex(...)
+    :param src: str
+        The name of the index (or alias) to read from.
+    :param dst: str
+        The name of the index to create and write to.
+    :param transform: callable (optional)
+        Function applied to the source of each document which returns the
+        document to write or None to skip it. Documents keep their id.
+    :param alias: str (optional)
+        Alias to point to the target index (and away from any other index)
+        when done.
+    :param doc_type: str (optional)
+        The document type to write (for Elastic versions before 7.0 the type
+        of the source documents is used if not set).
+    :param query: dict (optional)
+        Search body to select the documents to copy.
+    :param settings: dict (optional)
+        Index settings for the target index, e.g. number_of_shards or
+        number_of_replicas (which are copied from the source by default).
+    :param force_merge: bool or int (optional)
+        Whether to force merge the target index (to the given number of
+        segments if an int) before it's made available.
+    :param hosts: str or iterable (optional)
+        Hosts which serve as contact points for the Elastic client.
+    :param slices_per_shard: int (optional)
+        The number of partitions to read each shard of the source with.
+    :param kwargs:
+        Keyword arguments passed on to elastic_bulk (e.g. concurrency).
+    :return: bndl_elastic.bulk.BulkStats
+    '''
+    with elastic_client(self, hosts=hosts) as client:
+        if client.indices.exists(dst):
+            raise ValueError('Index %r already exists' % dst)
+        version = elastic_version(client)
+        source = client.indices.get(src)
+        if not source:
+            raise ValueError('Index %r not found' % src)
+        source = source[sorted(source)[0]]
+        target = _target_settings(source['settings']['index'], settings)
+        client.indices.create(dst, body={
+            'settings': {'index': dict(target, number_of_replicas=0, refresh_interval='-1')},
+            'mappings': source['mappings'],
+        })
+
+    if doc_type is None and version < (7,):
+        actions = lambda hit: _action(dst, hit['_type'], transform, hit)
+    else:
+        actions = lambda hit: _action(dst, doc_type, transform, hit)
+
+    try:
+        search_kwargs = {'query': query} if query else {}
+        dset = self.elastic_search(src, hosts=hosts, slices_per_shard=slices_per_shard, **search_kwargs)
+        stats = dset.map(actions).filter().elastic_bulk(hosts=hosts, **kwargs).sum()
+    finally:
+        with elastic_client(self, hosts=hosts) as client:
+            client.indices.put_settings(index=dst, body={'index': {
+                'number_of_replicas': target['number_of_replicas'],
+                'refresh_interval': target['refresh_interval'],
+            }})
+
+    with elastic_client(self, hosts=hosts) as client:
+        if force_merge:
+            max_num_segments = 1 if force_merge is True else force_merge
+            client.indices.forcemerge(dst, max_num_segments=max_num_segments, request_timeout=3600)
+        client.indices.refresh(dst)
+        if alias:
+            _swap_alias(client, alias, dst)
+
+    logger.info('Reindexed %s into %s: %r', src, dst, stats)
+    return stats
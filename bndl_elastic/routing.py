@@ -0,0 +1,187 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Routing of documents to shards the way Elastic (2.0 and later) does it, so
+that bulk actions can be sent to the node which holds the primary shard of
+the documents.
+'''
+
+from operator import itemgetter
+
+from bndl.compute.dataset import Dataset, Partition, NODE_LOCAL
+from bndl_elastic.client import elastic_client, elastic_version, parse_hostname
+
+
+_M32 = 0xffffffff
+
+
+def _rotl32(x, r):
+    return ((x << r) | (x >> (32 - r))) & _M32
+
+
+def murmur3_x86_32(data, seed=0):
+    '''
+    The 32 bit x86 variant of MurmurHash3 as signed int.
+    '''
+    c1 = 0xcc9e2d51
+    c2 = 0x1b873593
+    length = len(data)
+    h1 = seed
+    end = length & ~3
+
+    for i in range(0, end, 4):
+        k1 = data[i] | data[i + 1] << 8 | data[i + 2] << 16 | data[i + 3] << 24
+        k1 = _rotl32((k1 * c1) & _M32, 15)
+        h1 ^= (k1 * c2) & _M32
+        h1 = (_rotl32(h1, 13) * 5 + 0xe6546b64) & _M32
+
+    tail = length & 3
+    if tail:
+        k1 = 0
+        if tail == 3:
+            k1 ^= data[end + 2] << 16
+        if tail >= 2:
+            k1 ^= data[end + 1] << 8
+        k1 ^= data[end]
+        k1 = _rotl32((k1 * c1) & _M32, 15)
+        h1 ^= (k1 * c2) & _M32
+
+    h1 ^= length
+    h1 ^= h1 >> 16
+    h1 = (h1 * 0x85ebca6b) & _M32
+    h1 ^= h1 >> 13
+    h1 = (h1 * 0xc2b2ae35) & _M32
+    h1 ^= h1 >> 16
+
+    return h1 - (1 << 32) if h1 & 0x80000000 else h1
+
+
+def routing_hash(routing):
+    '''
+    The hash of a routing value (e.g. a document id) as computed by Elastic:
+    murmur3 over the UTF-16 (little endian) code units of the string.
+    '''
+    return murmur3_x86_32(str(routing).encode('utf-16-le'))
+
+
+
+class ShardRouting(object):
+    '''
+    The routing of documents to the (primary) shards of an index.
+
+    :ivar index: The name of the (concrete) index.
+    :ivar num_shards: The number of primary shards.
+    :ivar routing_num_shards: The number of shards used for routing (differs
+        from num_shards for indices which can be split).
+    :ivar primaries: The address of the node of the primary of each shard
+        (None if unassigned).
+    '''
+
+    def __init__(self, index, num_shards, routing_num_shards, primaries):
+        self.index = index
+        self.num_shards = num_shards
+        self.routing_num_shards = routing_num_shards
+        self.routing_factor = routing_num_shards // num_shards
+        self.primaries = primaries
+
+
+    @classmethod
+    def fetch(cls, ctx, index, hosts=None):
+        '''
+        Get the shard routing of an index from Elastic.
+        '''
+        with elastic_client(ctx, hosts=hosts) as client:
+            if elastic_version(client) < (2,):
+                raise ValueError('Routing to shards requires Elastic 2.0 or later')
+            resp = client.search_shards(index)
+            indices = {shard[0]['index'] for shard in resp['shards']}
+            if len(indices) != 1:
+                raise ValueError('Routing to shards requires exactly one index, %r resolves to %s'
+                                 % (index, ', '.join(sorted(indices)) or 'none'))
+            index = indices.pop()
+            state = client.cluster.state(metric='metadata', index=index)
+
+        num_shards = len(resp['shards'])
+        routing_num_shards = state['metadata']['indices'][index].get('routing_num_shards', num_shards)
+
+        nodes = resp['nodes']
+        primaries = [None] * num_shards
+        for shard in resp['shards']:
+            for allocation in shard:
+                if allocation['primary'] and allocation['node']:
+                    address = nodes[allocation['node']]['transport_address']
+                    primaries[allocation['shard']] = parse_hostname(address)
+
+        return cls(index, num_shards, routing_num_shards, primaries)
+
+
+    def shard(self, routing):
+        '''
+        The shard a document with the given routing value (by default its id)
+        is routed to.
+        '''
+        return (routing_hash(routing) % self.routing_num_shards) // self.routing_factor
+
+
+
+def partition_by_shard(dset, routing, doc_id):
+    '''
+    Repartition a dataset such that partition i contains the elements of
+    shard i and is computed preferably on the node of the primary of shard i.
+
+    :param dset: bndl.compute.dataset.Dataset
+        The dataset to repartition.
+    :param routing: ShardRouting
+        The routing of the index to write to.
+    :param doc_id: callable
+        Extracts the document id from the elements of dset.
+    '''
+    keyed = dset.map(lambda element: (routing.shard(doc_id(element)), element))
+    shuffled = keyed.shuffle(routing.num_shards, partitioner=int, key=itemgetter(0))
+    return PrimaryLocalDataset(shuffled.map(itemgetter(1)), routing.primaries)
+
+
+
+class PrimaryLocalDataset(Dataset):
+    '''
+    Dataset with the partitions of its source dataset, partition i is node
+    local to the node of the primary of shard i.
+    '''
+
+    def __init__(self, src, primaries):
+        super().__init__(src.ctx, src)
+        self.primaries = primaries
+
+
+    def parts(self):
+        return [
+            PrimaryLocalPartition(self, idx, part, self.primaries[idx])
+            for idx, part in enumerate(self.src.parts())
+        ]
+
+
+
+class PrimaryLocalPartition(Partition):
+    def __init__(self, dset, idx, src, primary):
+        super().__init__(dset, idx, src)
+        self.primary = primary
+
+
+    def _locality(self, workers):
+        for worker in workers:
+            if self.primary in worker.ip_addresses():
+                yield worker, NODE_LOCAL
+
+
+    def _compute(self):
+        return self.src.compute()
@@ -0,0 +1,96 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class OrjsonSerializer(JSONSerializer):
+    '''
+    Serializer for the Elastic client based on orjson. Types orjson doesn't
+    support natively are converted with JSONSerializer.default.
+    '''
+
+    def dumps(self, data):
+        if isinstance(data, str):
+            return data
+        try:
+            return orjson.dumps(data, default=self.default,
+                                option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        except (ValueError, TypeError) as e:
+            raise SerializationError(data, e)
+
+
+    def loads(self, s):
+        try:
+            return orjson.loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+
+
+class UjsonSerializer(JSONSerializer):
+    '''
+    Serializer for the Elastic client based on ujson. Data ujson can't
+    serialize is serialized with the standard library json module.
+    '''
+
+    def dumps(self, data):
+        if isinstance(data, str):
+            return data
+        try:
+            return ujson.dumps(data, ensure_ascii=False)
+        except (ValueError, TypeError, OverflowError):
+            return super().dumps(data)
+
+
+    def loads(self, s):
+        try:
+            return ujson.loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+
+
+def get_serializer(name='auto'):
+    '''
+    Get a serializer for the Elastic client by name.
+
+    :param name: str
+        One of orjson, ujson, json or auto. With auto the fastest serializer
+        available is selected (orjson, ujson and json in that order).
+    '''
+    if name == 'auto':
+        name = 'orjson' if orjson else 'ujson' if ujson else 'json'
+
+    if name == 'orjson':
+        if not orjson:
+            raise ValueError('orjson is not installed')
+        return OrjsonSerializer()
+    elif name == 'ujson':
+        if not ujson:
+            raise ValueError('ujson is not installed')
+        return UjsonSerializer()
+    elif name == 'json':
+        return JSONSerializer()
+    else:
+        raise ValueError('Unknown serializer %r' % name)
@@ -0,0 +1,58 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+import json
+
+from bndl_elastic.bulk_body import ActionEncoder, bulk_body, chunk_actions, encode_action
+from bndl_elastic.serializers import get_serializer
+
+
+class BulkBodyTest(TestCase):
+    def test_encoder(self):
+        for name in ('json', 'auto'):
+            serializer = get_serializer(name)
+            for encoder, element, expected in (
+                (ActionEncoder('index', 'i', 't'), {'a': 1},
+                 ({'index': {'_index': 'i', '_type': 't'}}, {'a': 1})),
+                (ActionEncoder('create', 'i', 't'), (1, {'a': 1}),
+                 ({'create': {'_index': 'i', '_type': 't', '_id': 1}}, {'a': 1})),
+                (ActionEncoder('update', 'i'), ('x', {'a': 1}),
+                 ({'update': {'_index': 'i', '_id': 'x'}}, {'doc': {'a': 1}})),
+                (ActionEncoder('update', 'i', doc_as_upsert=True), ('x', {'a': 1}),
+                 ({'update': {'_index': 'i', '_id': 'x'}}, {'doc': {'a': 1}, 'doc_as_upsert': True})),
+                (ActionEncoder('delete'), 'y',
+                 ({'delete': {'_id': 'y'}}, None)),
+            ):
+                header, source = encoder(serializer)(element)
+                self.assertEqual(json.loads(header), expected[0])
+                self.assertEqual(json.loads(source) if source else None, expected[1])
+
+        with self.assertRaises(ValueError):
+            ActionEncoder('upsert')
+
+    def test_encode_action(self):
+        header, source = encode_action(get_serializer('json'), {
+            '_op_type': 'create', '_index': 'i', '_id': 1, '_source': {'a': 1}
+        })
+        self.assertEqual(json.loads(header), {'create': {'_index': 'i', '_id': 1}})
+        self.assertEqual(json.loads(source), {'a': 1})
+
+    def test_chunks(self):
+        actions = [('{"delete":{"_id":%s}}' % i, None) for i in range(100)]
+        self.assertEqual([len(chunk) for chunk in chunk_actions(actions, lambda: 30, 10 ** 6)],
+                         [30, 30, 30, 10])
+        size = len(actions[0][0]) + 1
+        self.assertEqual([len(chunk) for chunk in chunk_actions(actions[:10], lambda: 30, size * 4)],
+                         [4, 4, 2])
+        body = bulk_body([('{"index":{}}', '{"a":1}'), ('{"delete":{"_id":1}}', None)])
+        self.assertEqual(body, '{"index":{}}\n{"a":1}\n{"delete":{"_id":1}}\n')
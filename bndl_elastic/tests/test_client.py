@@ -0,0 +1,39 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+
+from bndl_elastic.client import NodeLocalConnectionPool
+
+
+class FakeConnection(object):
+    def __init__(self, host):
+        self.host = host
+
+
+
+class NodeLocalConnectionPoolTest(TestCase):
+    def test_select_local(self):
+        remote = FakeConnection('http://192.0.2.1:9200')
+        local = FakeConnection('http://127.0.0.1:9200')
+        pool = NodeLocalConnectionPool([(remote, {}), (local, {})], randomize_hosts=False)
+        self.assertEqual(pool.selector.local_connections, [local])
+        self.assertEqual(pool.selector.live, {remote, local})
+        self.assertIs(pool.get_connection(), local)
+
+        pool.mark_dead(local)
+        self.assertEqual(pool.selector.live, {remote})
+        self.assertIs(pool.get_connection(), remote)
+
+        self.assertIs(pool.resurrect(force=True), local)
+        self.assertEqual(pool.selector.live, {remote, local})
+        self.assertIs(pool.get_connection(), local)
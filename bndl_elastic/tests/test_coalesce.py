@@ -0,0 +1,67 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+
+from bndl_elastic.bulk_body import ActionEncoder
+from bndl_elastic.coalesce import coalesced, deep_merge
+
+
+class CoalesceTest(TestCase):
+    def test_deep_merge(self):
+        a = {'x': 1, 'o': {'a': 1, 'b': [1]}}
+        b = {'y': 2, 'o': {'b': [2], 'c': 3}}
+        self.assertEqual(deep_merge(a, b), {'x': 1, 'y': 2, 'o': {'a': 1, 'b': [2], 'c': 3}})
+        self.assertEqual(a, {'x': 1, 'o': {'a': 1, 'b': [1]}})
+
+    def test_updates(self):
+        updates = [(1, {'a': 1}), (2, {'a': 2}), (1, {'b': {'c': 1}}), (1, {'b': {'d': 2}})]
+        encoder = ActionEncoder('update', 'index')
+        self.assertEqual(list(coalesced(updates, encoder)),
+                         [(1, {'a': 1, 'b': {'c': 1, 'd': 2}}), (2, {'a': 2})])
+        self.assertEqual(list(coalesced(updates, encoder, 'last')),
+                         [(1, {'b': {'d': 2}}), (2, {'a': 2})])
+
+    def test_window(self):
+        updates = [(1, {'a': 1}), (2, {'a': 2}), (3, {'a': 3}), (1, {'b': 1})]
+        encoder = ActionEncoder('update', 'index')
+        self.assertEqual(list(coalesced(updates, encoder, window=2)),
+                         [(1, {'a': 1}), (2, {'a': 2}), (3, {'a': 3}), (1, {'b': 1})])
+        self.assertEqual(len(list(coalesced(updates, encoder, window=3))), 3)
+
+    def test_create_and_delete(self):
+        self.assertEqual(list(coalesced([(1, 'a'), (1, 'b')], ActionEncoder('create', 'index'))), [(1, 'a')])
+        self.assertEqual(list(coalesced([1, 2, 1], ActionEncoder('delete', 'index'))), [1, 2])
+        docs = [{'a': 1}, {'a': 1}]
+        self.assertEqual(list(coalesced(docs, ActionEncoder('index', 'index'))), docs)
+
+    def test_actions(self):
+        actions = [
+            {'_index': 'i', '_id': 1, '_source': {'a': 1}},
+            {'_index': 'i', '_id': 1, '_op_type': 'update', 'doc': {'b': 2}},
+            {'_index': 'i', '_id': 2, '_op_type': 'update', 'doc': {'a': 1}},
+            {'_index': 'i', '_id': 2, '_op_type': 'update', 'doc': {'b': 1}, 'doc_as_upsert': True},
+            {'_index': 'i', '_id': 3, '_source': {'a': 1}},
+            {'_index': 'i', '_id': 3, '_op_type': 'delete'},
+            {'_index': 'i', '_id': 4, '_op_type': 'update', 'doc': {'a': 1}},
+            {'_index': 'i', '_id': 4, '_op_type': 'update', 'script': {'source': 'x'}},
+            {'_index': 'i', '_source': {'no': 'id'}},
+        ]
+        # the partial update of 4 is flushed when the (not combinable) scripted update arrives
+        self.assertEqual(list(coalesced(actions)), [
+            {'_index': 'i', '_id': 4, '_op_type': 'update', 'doc': {'a': 1}},
+            {'_index': 'i', '_source': {'no': 'id'}},
+            {'_index': 'i', '_id': 1, '_source': {'a': 1, 'b': 2}},
+            {'_index': 'i', '_id': 2, '_op_type': 'update', 'doc': {'a': 1, 'b': 1}, 'doc_as_upsert': True},
+            {'_index': 'i', '_id': 3, '_op_type': 'delete'},
+            {'_index': 'i', '_id': 4, '_op_type': 'update', 'script': {'source': 'x'}},
+        ])
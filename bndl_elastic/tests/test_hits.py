@@ -0,0 +1,78 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+import pickle
+
+from bndl_elastic.hits import Hit
+
+
+class HitTest(TestCase):
+    hit = {
+        '_id': '1',
+        '_index': 'test_index',
+        '_type': 'test_doc',
+        '_score': 1.0,
+        '_source': {'name': 'test', 'number': 1, 'nested': {'list': [1, 2]}},
+    }
+
+    def test_item_access(self):
+        hit = Hit.from_dict(self.hit)
+        self.assertEqual(hit['_id'], '1')
+        self.assertEqual(hit['_index'], 'test_index')
+        self.assertEqual(hit['_source'], self.hit['_source'])
+        self.assertEqual(hit.get('sort'), None)
+        self.assertNotIn('sort', hit)
+        with self.assertRaises(KeyError):
+            hit['sort']
+        self.assertEqual(hit, self.hit)
+        self.assertEqual(hit.to_dict(), self.hit)
+
+    def test_lazy_source(self):
+        hit = Hit.from_dict(self.hit)
+        self.assertIsInstance(hit._raw_source, bytes)
+        self.assertIsNone(hit._decoded_source)
+        self.assertEqual(hit.source['name'], 'test')
+        self.assertIsNotNone(hit._decoded_source)
+
+    def test_interned(self):
+        a = Hit.from_dict(dict(self.hit, _index=''.join(['test', '_index'])))
+        b = Hit.from_dict(dict(self.hit, _index=''.join(['test', '_index'])))
+        self.assertIs(a.index, b.index)
+
+    def test_pickle(self):
+        hit = pickle.loads(pickle.dumps(Hit.from_dict(self.hit)))
+        self.assertIsNone(hit._decoded_source)
+        self.assertEqual(hit, self.hit)
+
+        hit.source['name'] = 'changed'
+        hit = pickle.loads(pickle.dumps(hit))
+        self.assertEqual(hit['_source']['name'], 'changed')
+
+    def test_scan_hit(self):
+        # hits of scans have no score
+        hit = {
+            '_index': 'test_index',
+            '_type': 'test_doc',
+            '_id': '2',
+            '_score': None,
+            '_source': {'name': 'test'},
+            'sort': [0],
+        }
+        compact = Hit.from_dict(hit)
+        self.assertEqual(compact, hit)
+        self.assertEqual(compact.to_dict(), hit)
+        self.assertIn('_score', compact)
+        self.assertIsNone(compact['_score'])
+        self.assertNotIn('fields', compact)
+        self.assertEqual(sorted(compact.keys()), sorted(hit))
+        self.assertEqual(pickle.loads(pickle.dumps(compact)), hit)
@@ -10,8 +10,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from functools import partial
+from unittest import TestCase
+import threading
+import time
+
 from bndl.rmi import InvocationException
+from bndl_elastic.bulk import AdaptiveChunkSize, _bulk_kwargs, _execute_chunk
 from bndl_elastic.tests import ElasticTest
+from bndl_elastic.tuning import BULK_LOAD_SETTINGS, bulk_load_mode
+from elasticsearch.helpers import BulkIndexError
+
+
+def _slow_doc(i):
+    time.sleep(.01)
+    return i, {'name': str(i)}
+
+
+def _with_durability(ctx, index, i):
+    with ctx.elastic_client() as client:
+        resp = client.indices.get_settings(index, flat_settings=True)
+    return i, {'durability': resp[index]['settings'].get('index.translog.durability')}
+
 
 
 class IndexTest(ElasticTest):
@@ -20,7 +40,7 @@ class IndexTest(ElasticTest):
         inserts = self.ctx.range(100).with_value(lambda i: {'name': str(i)})
         saved = inserts.elastic_create(refresh=True).sum()
         self.refresh()
-        self.assertEqual(saved, 100)
+        self.assertEqual(saved.success, 100)
         scan = self.ctx.elastic_search()
         self.assertEqual(scan.count(), 100)
 
@@ -28,7 +48,7 @@ class IndexTest(ElasticTest):
         updates = self.ctx.range(100).with_value(lambda i: {'number': i})
         updated = updates.elastic_update(refresh=True).sum()
         self.refresh()
-        self.assertEqual(updated, 100)
+        self.assertEqual(updated.success, 100)
         self.assertEqual(scan.count(), 100)
         hits = scan.collect()
         self.assertEqual(list(range(100)), sorted(int(hit['_id']) for hit in hits))
@@ -39,7 +59,7 @@ class IndexTest(ElasticTest):
         upserts = self.ctx.range(200).with_value(lambda i: {'text': str(i)})
         upserted = upserts.elastic_upsert(refresh=True).sum()
         self.refresh()
-        self.assertEqual(upserted, 200)
+        self.assertEqual(upserted.success, 200)
         self.assertEqual(scan.pluck('_source').filter(lambda hit: 'name' in hit).count(), 100)
         self.assertEqual(scan.pluck('_source').filter(lambda hit: 'number' in hit).count(), 100)
         self.assertEqual(scan.pluck('_source').filter(lambda hit: 'text' in hit).count(), 200)
@@ -49,7 +69,7 @@ class IndexTest(ElasticTest):
         creates = self.ctx.range(200, 300).with_value(lambda i: {'text': str(i)})
         created = creates.elastic_create(refresh=True).sum()
         self.refresh()
-        self.assertEqual(created, 100)
+        self.assertEqual(created.success, 100)
         self.assertEqual(scan.pluck('_source').filter(lambda hit: 'name' in hit).count(), 100)
         self.assertEqual(scan.pluck('_source').filter(lambda hit: 'number' in hit).count(), 100)
         self.assertEqual(scan.pluck('_source').filter(lambda hit: 'text' in hit).count(), 300)
@@ -62,8 +82,235 @@ class IndexTest(ElasticTest):
         # delete
         deleted = self.ctx.range(100, 200).elastic_delete(refresh=True).sum()
         self.refresh()
-        self.assertEqual(deleted, 100)
+        self.assertEqual(deleted.success, 100)
         self.assertEqual(scan.pluck('_id').map(int).sort().collect(),
                          list(range(100)) + list(range(200, 300)))
         scan.pluck('_id').elastic_delete(refresh=True).execute()
         self.assertEqual(scan.count(), 0)
+
+    def test_concurrent_index(self):
+        docs = self.ctx.range(1000, pcount=4).with_value(lambda i: {'name': str(i)})
+        saved = docs.elastic_create(refresh=True, concurrency=4, chunk_size=50).sum()
+        self.refresh()
+        self.assertEqual(saved.success, 1000)
+        self.assertEqual(self.ctx.elastic_search().count(), 1000)
+
+    def test_stats(self):
+        docs = self.ctx.range(100, pcount=5).with_value(lambda i: {'name': str(i)})
+        stats = docs.elastic_create(refresh=True, chunk_size=10).sum()
+        self.assertEqual(stats.success, 100)
+        self.assertEqual(stats.failed, 0)
+        self.assertEqual(stats.partitions, 5)
+        self.assertEqual(stats.requests, 10)
+        self.assertEqual(sum(stats.latencies), 10)
+        self.assertEqual(stats.max_chunk_size, 10)
+        self.assertGreater(stats.bytes, 0)
+
+        stats = docs.elastic_create(raise_on_error=False).sum()
+        self.assertEqual(stats.success, 0)
+        self.assertEqual(stats.failed, 100)
+        self.assertEqual(sum(stats.errors.values()), 100)
+
+    def test_bulk_load_mode(self):
+        def settings():
+            with self.ctx.elastic_client() as client:
+                resp = client.indices.get_settings(self.index, flat_settings=True)
+                return resp[self.index]['settings']
+
+        def assert_restored():
+            restored = settings()
+            for key in BULK_LOAD_SETTINGS:
+                self.assertEqual(restored.get(key), original.get(key))
+
+        original = settings()
+        docs = self.ctx.range(100).map(partial(_with_durability, self.ctx, self.index))
+        load = docs.elastic_upsert(bulk_load_mode=True)
+        # building the dataset doesn't change the settings
+        assert_restored()
+
+        # the settings are tuned while each job runs and restored afterwards
+        for _ in range(2):
+            self.assertEqual(load.sum().success, 100)
+            assert_restored()
+            hits = self.ctx.elastic_search().collect()
+            self.assertEqual(len(hits), 100)
+            self.assertTrue(all(hit['_source']['durability'] == 'async' for hit in hits))
+            with self.ctx.elastic_client() as client:
+                client.delete_by_query(self.index, {'query': {'match_all': {}}}, refresh=True)
+
+        with self.assertRaises(InvocationException):
+            with bulk_load_mode(self.ctx, self.index):
+                self.assertEqual(settings()['index.translog.durability'], 'async')
+                self.ctx.range(1).map(lambda i: 1 / 0).elastic_create().execute()
+        assert_restored()
+
+    def test_concurrent_bulk_load_mode(self):
+        def settings():
+            with self.ctx.elastic_client() as client:
+                resp = client.indices.get_settings(self.index, flat_settings=True)
+                return resp[self.index]['settings']
+
+        original = settings()
+        with bulk_load_mode(self.ctx, self.index):
+            with bulk_load_mode(self.ctx, self.index):
+                pass
+            # still tuned for the outer bulk load
+            self.assertEqual(settings()['index.translog.durability'], 'async')
+        restored = settings()
+        for key in BULK_LOAD_SETTINGS:
+            self.assertEqual(restored.get(key), original.get(key))
+
+        def load(start, results):
+            docs = self.ctx.range(start, start + 100, pcount=4).map(_slow_doc)
+            results.append(docs.elastic_create(bulk_load_mode=True).sum())
+
+        results = []
+        threads = [threading.Thread(target=load, args=(start, results)) for start in (0, 100)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([stats.success for stats in results], [100, 100])
+        restored = settings()
+        for key in BULK_LOAD_SETTINGS:
+            self.assertEqual(restored.get(key), original.get(key))
+        self.assertEqual(self.ctx.elastic_search().count(), 200)
+
+    def test_reindex(self):
+        target = self.index + '_reindexed'
+        alias = self.index + '_alias'
+        with self.ctx.elastic_client() as client:
+            client.indices.delete(target, ignore=404)
+
+        docs = self.ctx.range(100).with_value(lambda i: {'number': i})
+        docs.elastic_create(refresh=True).sum()
+        self.refresh()
+
+        transform = lambda doc: dict(doc, double=doc['number'] * 2) if doc['number'] % 2 else None
+        stats = self.ctx.elastic_reindex(self.index, target, transform, alias=alias, force_merge=True)
+        self.assertEqual(stats.success, 50)
+
+        hits = self.ctx.elastic_search(alias).collect()
+        self.assertEqual(sorted(int(hit['_id']) for hit in hits), list(range(1, 100, 2)))
+        self.assertTrue(all(hit['_source']['double'] == int(hit['_id']) * 2 for hit in hits))
+        with self.ctx.elastic_client() as client:
+            settings = client.indices.get_settings(target)[target]['settings']['index']
+            self.assertEqual(settings['number_of_replicas'], '0')
+            self.assertNotEqual(settings.get('refresh_interval'), '-1')
+            self.assertEqual(list(client.indices.get_alias(name=alias)), [target])
+        with self.assertRaises(ValueError):
+            self.ctx.elastic_reindex(self.index, target)
+
+    def test_dead_letter(self):
+        self.ctx.range(50).with_value(lambda i: {'name': str(i)}).elastic_create(refresh=True).sum()
+        docs = self.ctx.range(100, pcount=4).with_value(lambda i: {'name': str(i)})
+        stats = docs.elastic_create(dead_letter=True).sum()
+        self.assertEqual(stats.success, 50)
+        self.assertEqual(stats.failed, 50)
+        self.assertEqual(sorted(int(dead_letter['action']['create']['_id']) for dead_letter in stats.dead_letters),
+                         list(range(50)))
+
+    def test_coalesce(self):
+        updates = self.ctx.range(300, pcount=1).map(lambda i: (i % 100, {'doc': {str(i // 100): i}}))
+        stats = updates.elastic_upsert(refresh=True, coalesce='merge').sum()
+        self.refresh()
+        self.assertEqual(stats.success, 100)
+        hits = self.ctx.elastic_search().collect()
+        self.assertEqual(len(hits), 100)
+        for hit in hits:
+            doc_id = int(hit['_id'])
+            self.assertEqual(hit['_source']['doc'], {str(n): doc_id + n * 100 for n in range(3)})
+
+    def test_adaptive_index(self):
+        docs = self.ctx.range(1000, pcount=4).with_value(lambda i: {'name': str(i)})
+        saved = docs.elastic_create(refresh=True, adaptive=True, chunk_size=10).sum()
+        self.refresh()
+        self.assertEqual(saved.success, 1000)
+        self.assertEqual(self.ctx.elastic_search().count(), 1000)
+
+
+
+class AdaptiveChunkSizeTest(TestCase):
+    def test_adapt(self):
+        chunk_size = AdaptiveChunkSize(100, min_size=10, max_size=200, target_latency=1)
+        self.assertEqual(chunk_size(), 100)
+        chunk_size.completed(.5)
+        self.assertEqual(chunk_size(), 125)
+        for _ in range(10):
+            chunk_size.completed(.5)
+        self.assertEqual(chunk_size(), 200)
+        chunk_size.completed(4)
+        self.assertEqual(chunk_size(), 50)
+
+        self.assertEqual(chunk_size.rejected(), chunk_size.initial_backoff)
+        self.assertEqual(chunk_size(), 25)
+        self.assertEqual(chunk_size.rejected(), chunk_size.initial_backoff * 2)
+        self.assertEqual(chunk_size(), 12)
+        chunk_size.rejected()
+        self.assertEqual(chunk_size(), 10)
+        chunk_size.completed(.5)
+        self.assertEqual(chunk_size.rejected(), chunk_size.initial_backoff)
+
+
+
+class FailingBulkClient(object):
+    '''
+    Fake client which responds to bulk requests with the given statuses (per
+    request) for the actions in order.
+    '''
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.requests = []
+
+    def bulk(self, body, **kwargs):
+        self.requests.append(body)
+        items = []
+        for status in self.statuses.pop(0):
+            result = {'status': status}
+            if status >= 300:
+                result['error'] = {'type': 'error_%s' % status}
+            items.append({'create': result})
+        return {'items': items}
+
+
+
+class ExecuteChunkTest(TestCase):
+    chunk = [('{"create":{"_id":%s}}' % i, '{"i":%s}' % i) for i in range(4)]
+
+    def test_retry(self):
+        client = FailingBulkClient((201, 429, 503, 201), (201, 201))
+        stats = _execute_chunk(client, lambda: 4, self.chunk, initial_backoff=0)
+        self.assertEqual(stats.success, 4)
+        self.assertEqual(stats.retries, 2)
+        self.assertEqual(stats.requests, 2)
+        self.assertEqual(client.requests[1], '{"create":{"_id":1}}\n{"i":1}\n{"create":{"_id":2}}\n{"i":2}\n')
+
+    def test_dead_letter(self):
+        client = FailingBulkClient((201, 409, 429, 201), (201,))
+        with self.assertRaises(BulkIndexError):
+            _execute_chunk(client, lambda: 4, self.chunk, initial_backoff=0)
+
+        client = FailingBulkClient((201, 409, 429, 201), (400,))
+        dead_letters = []
+        stats = _execute_chunk(client, lambda: 4, self.chunk, initial_backoff=0, dead_letter=dead_letters.extend)
+        self.assertEqual(stats.success, 2)
+        self.assertEqual(stats.failed, 2)
+        self.assertEqual(dict(stats.errors), {'error_409': 1, 'error_400': 1})
+        self.assertEqual([dead_letter['action'] for dead_letter in dead_letters],
+                         [{'create': {'_id': 1}}, {'create': {'_id': 2}}])
+        self.assertEqual(dead_letters[0]['source'], {'i': 1})
+        self.assertEqual(dead_letters[0]['error']['status'], 409)
+
+    def test_helper_args(self):
+        self.assertEqual(_bulk_kwargs({'max_retries': 2, 'pipeline': 'p'}), {'max_rejections': 2, 'pipeline': 'p'})
+        client = FailingBulkClient((429, 429, 429, 429), (429, 429, 429, 429))
+        stats = _execute_chunk(client, lambda: 4, self.chunk, initial_backoff=0, raise_on_error=False,
+                               **_bulk_kwargs({'max_retries': 1}))
+        self.assertEqual(stats.requests, 2)
+        self.assertEqual(stats.failed, 4)
+        for key in ('stats_only', 'yield_ok', 'expand_action_callback'):
+            with self.assertRaises(TypeError):
+                _bulk_kwargs({key: True})
+        with self.assertRaises(TypeError):
+            _bulk_kwargs({'max_retries': 1, 'max_rejections': 1})
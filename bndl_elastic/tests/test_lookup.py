@@ -0,0 +1,139 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+
+from bndl_elastic.lookup import LRUCache, _cache, _caches, _lookup_batch, _msearch_batch
+from elasticsearch.exceptions import TransportError
+from elasticsearch.serializer import JSONSerializer
+from bndl_elastic.tests import ElasticTest
+
+
+class LookupTest(ElasticTest):
+    def setUp(self):
+        super().setUp()
+        with self.ctx.elastic_client() as client:
+            for i in range(50):
+                client.index(self.index, self.doc_type, {'name': str(i), 'number': i}, id=i)
+            client.indices.refresh(self.index)
+
+    def test_lookup(self):
+        records = self.ctx.range(100).map(lambda i: {'ref': i % 60})
+        pairs = records.elastic_lookup(key=lambda record: record['ref'], fields=['number'], batch_size=7).collect()
+        self.assertEqual(len(pairs), 100)
+        for record, doc in pairs:
+            if record['ref'] < 50:
+                self.assertEqual(doc, {'number': record['ref']})
+            else:
+                self.assertIsNone(doc)
+
+        docs = self.ctx.range(10).elastic_lookup(cache_size=0).values().collect()
+        self.assertEqual([doc['name'] for doc in docs], [str(i) for i in range(10)])
+
+    def test_msearch(self):
+        query = lambda i: {'query': {'range': {'number': {'gte': i}}}, 'sort': ['number']} if i % 10 else None
+        pairs = self.ctx.range(60).elastic_msearch(query_fn=query, size=3, batch_size=7).collect()
+        self.assertEqual(len(pairs), 60)
+        for i, hits in pairs:
+            if i % 10 == 0:
+                self.assertEqual(hits, [])
+            else:
+                self.assertEqual([hit['_source']['number'] for hit in hits], list(range(i, min(i + 3, 50))))
+
+
+
+class FakeMgetClient(object):
+    def __init__(self, docs):
+        self.docs = docs
+        self.requests = []
+
+    def mget(self, body, **kwargs):
+        self.requests.append(body['ids'])
+        return {'docs': [
+            {'_id': doc_id, 'found': True, '_source': self.docs[doc_id]} if doc_id in self.docs else
+            {'_id': doc_id, 'found': False}
+            for doc_id in body['ids']
+        ]}
+
+
+
+class FakeMsearchClient(object):
+    class transport(object):
+        serializer = JSONSerializer()
+
+    def __init__(self):
+        self.requests = []
+
+    def msearch(self, body):
+        self.requests.append(body)
+        lines = body.strip().split('\n')
+        responses = []
+        for query in lines[1::2]:
+            if 'fail' in query:
+                responses.append({'error': {'type': 'parsing_exception'}, 'status': 400})
+            else:
+                responses.append({'hits': {'hits': [{'_source': {'query': query}}]}})
+        return {'responses': responses}
+
+
+
+class LookupBatchTest(TestCase):
+    def test_dedup_and_cache(self):
+        client = FakeMgetClient({'1': {'a': 1}, '2': {'a': 2}})
+        cache = LRUCache(10)
+        pairs = _lookup_batch(client, 'index', None, None, None, cache, [1, 2, 1, 3])
+        self.assertEqual(pairs, [(1, {'a': 1}), (2, {'a': 2}), (1, {'a': 1}), (3, None)])
+        self.assertEqual(client.requests, [['1', '2', '3']])
+
+        pairs = _lookup_batch(client, 'index', None, None, None, cache, [3, 2, 4])
+        self.assertEqual(pairs, [(3, None), (2, {'a': 2}), (4, None)])
+        self.assertEqual(client.requests[1:], [['4']])
+
+    def test_lru(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+
+    def test_cache_scope(self):
+        with _cache('lookup', 5) as cache:
+            cache.put('a', 1)
+            with _cache('lookup', 10) as shared:
+                self.assertIs(shared, cache)
+            with _cache('other', 10) as other:
+                self.assertIsNot(other, cache)
+                self.assertEqual(other.max_size, 10)
+        self.assertEqual(cache.max_size, 5)
+        self.assertNotIn('lookup', _caches)
+        with _cache('lookup', 10) as cache:
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.max_size, 10)
+
+    def test_msearch(self):
+        client = FakeMsearchClient()
+        query = lambda record: None if record == 'skip' else {'query': {'term': {'f': record}}}
+        pairs = _msearch_batch(client, '{"index":"x"}', query, 5, True, ['a', 'skip', 'b'])
+        self.assertEqual([record for record, _ in pairs], ['a', 'skip', 'b'])
+        self.assertEqual(pairs[1][1], [])
+        self.assertEqual(len(pairs[2][1]), 1)
+        self.assertEqual(len(client.requests), 1)
+        self.assertEqual(client.requests[0].count('\n'), 4)
+        self.assertIn('"size": 5', client.requests[0])
+
+        with self.assertRaises(TransportError):
+            _msearch_batch(client, '{"index":"x"}', query, 5, True, ['a', 'fail'])
+        pairs = _msearch_batch(client, '{"index":"x"}', query, 5, False, ['a', 'fail'])
+        self.assertIsNone(pairs[1][1])
@@ -0,0 +1,166 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+import threading
+import time
+
+from bndl_elastic.pool import ClientPool
+from elasticsearch.exceptions import ConnectionError
+
+
+class FakeConnection(object):
+    def __init__(self, host, alive=True):
+        self.host = host
+        self.alive = alive
+
+    def perform_request(self, method, url, **kwargs):
+        if not self.alive:
+            raise ConnectionError('N/A', 'unreachable', None)
+        return 200, {}, ''
+
+
+class FakeConnectionPool(object):
+    def __init__(self, connections):
+        self.connections = connections
+        self.dead = []
+
+    def mark_dead(self, connection):
+        self.connections.remove(connection)
+        self.dead.append(connection)
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.connection_pool = FakeConnectionPool([FakeConnection('a'), FakeConnection('b', alive=False)])
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.transport = FakeTransport()
+
+
+
+class ClientPoolTest(TestCase):
+    def test_reuse(self):
+        pool = ClientPool(FakeClient, max_size=2)
+        client = pool.get()
+        self.assertIs(pool.get(), client)
+        pool.put(client)
+        pool.put(client)
+        self.assertIs(pool.get(), client)
+        pool.put(client)
+        stats = pool.stats()
+        self.assertEqual(stats['creations'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(stats['in_use'], 0)
+
+    def test_max_size(self):
+        pool = ClientPool(FakeClient, max_size=2, wait_timeout=.01)
+        clients = []
+        done = threading.Event()
+        threads = []
+
+        def take(taken):
+            clients.append(pool.get())
+            taken.set()
+            done.wait()
+
+        for _ in range(3):
+            taken = threading.Event()
+            threads.append(threading.Thread(target=take, args=(taken,)))
+            threads[-1].start()
+            taken.wait()
+        done.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(clients)), 2)
+        stats = pool.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['waits'], 1)
+        self.assertEqual(stats['shares'], 1)
+
+    def test_wait(self):
+        pool = ClientPool(FakeClient, max_size=1, wait_timeout=5)
+        client = pool.get()
+        threading.Timer(.1, pool.put, (client,)).start()
+        result = []
+        thread = threading.Thread(target=lambda: result.append(pool.get()))
+        thread.start()
+        thread.join()
+        self.assertIs(result[0], client)
+        self.assertEqual(pool.stats()['shares'], 0)
+
+    def test_evict_idle(self):
+        pool = ClientPool(FakeClient, max_idle=.05)
+        client = pool.get()
+        pool.put(client)
+        time.sleep(.1)
+        self.assertIsNot(pool.get(), client)
+        self.assertTrue(client.transport.closed)
+        self.assertEqual(pool.stats()['evictions'], 1)
+
+    def test_health_check(self):
+        pool = ClientPool(FakeClient, health_check_interval=60)
+        client = pool.get()
+        pool.put(client)
+        client = pool.get()
+        self.assertEqual([connection.host for connection in client.transport.connection_pool.connections], ['a'])
+        self.assertEqual(pool.stats()['dead_nodes'], 1)
+
+    def test_put_from_other_thread(self):
+        pool = ClientPool(FakeClient, max_idle=.05)
+        client = pool.get()
+        thread = threading.Thread(target=pool.put, args=(client,))
+        thread.start()
+        thread.join()
+        self.assertEqual(pool.stats()['in_use'], 0)
+        time.sleep(.1)
+        other = pool.get()
+        self.assertIsNot(other, client)
+        self.assertTrue(client.transport.closed)
+        self.assertFalse(other.transport.closed)
+        pool.put(other)
+        self.assertEqual(pool.stats()['in_use'], 0)
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_put_other_client(self):
+        pool = ClientPool(FakeClient, max_size=2)
+        taken = threading.Event()
+        done = threading.Event()
+        other = []
+
+        def take():
+            other.append(pool.get())
+            taken.set()
+            done.wait()
+
+        thread = threading.Thread(target=take)
+        thread.start()
+        taken.wait()
+        client = pool.get()
+        self.assertIsNot(client, other[0])
+        pool.put(other[0])
+        self.assertIs(pool.get(), client)
+        pool.put(client)
+        pool.put(client)
+        self.assertEqual(pool.stats()['in_use'], 0)
+        with self.assertRaises(ValueError):
+            pool.put(client)
+        done.set()
+        thread.join()
@@ -0,0 +1,52 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+
+from bndl_elastic.routing import routing_hash, ShardRouting
+from bndl_elastic.tests import ElasticTest
+
+
+def _signed(value):
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+class RoutingHashTest(TestCase):
+    def test_hash(self):
+        # test vectors from Elastic's Murmur3HashFunctionTests
+        self.assertEqual(routing_hash('hell'), _signed(0x5a0cb7c3))
+        self.assertEqual(routing_hash('hello'), _signed(0xd7c31989))
+        self.assertEqual(routing_hash('hello w'), _signed(0x22ab2984))
+
+    def test_shard(self):
+        routing = ShardRouting('idx', 5, 5, [None] * 5)
+        self.assertEqual({routing.shard(i) for i in range(1000)}, set(range(5)))
+        split = ShardRouting('idx', 5, 640, [None] * 5)
+        for i in range(1000):
+            self.assertEqual(split.shard(i), (routing_hash(i) % 640) // 128)
+
+
+
+class RouteToPrimariesTest(ElasticTest):
+    def test_route_to_primaries(self):
+        docs = self.ctx.range(1000).with_value(lambda i: {'name': str(i)})
+        routed = docs.elastic_create(refresh=True, route_to_primaries=True)
+        self.assertEqual(routed.sum().success, 1000)
+        self.refresh()
+
+        self.assertEqual(self.ctx.elastic_search().count(), 1000)
+
+        routing = ShardRouting.fetch(self.ctx, self.index)
+        with self.ctx.elastic_client() as client:
+            for i in range(0, 1000, 97):
+                shards = client.search_shards(self.index, routing=str(i))['shards']
+                self.assertEqual(shards[0][0]['shard'], routing.shard(i))
@@ -11,7 +11,10 @@
 # limitations under the License.
 
 from functools import partial
+import unittest
 
+from bndl_elastic.client import elastic_version
+from bndl_elastic.engines import search_after
 from bndl_elastic.tests import ElasticTest
 
 
@@ -41,3 +44,187 @@ class SearchTest(ElasticTest):
         self.assertEqual(read(query={
             'query': { 'range': { 'number': { 'gte': 20, 'lt': 50 } } }
         }).count(), 30)
+
+
+    def test_sliced_search(self):
+        with self.ctx.elastic_client() as client:
+            if elastic_version(client) < (5,):
+                raise unittest.SkipTest('sliced scroll requires Elastic 5.0 or later')
+        dset = self.ctx.elastic_search(self.index, self.doc_type, slices_per_shard=3)
+        self.assertEqual(dset.count(), 100)
+        self.assertEqual(len(dset.parts()), 3 * len(self.ctx.elastic_search(self.index, self.doc_type).parts()))
+        ids = dset.pluck('_id').collect()
+        self.assertEqual(sorted(ids, key=int), [str(i) for i in range(100)])
+
+    def test_docs_per_partition(self):
+        with self.ctx.elastic_client() as client:
+            if elastic_version(client) < (5,):
+                raise unittest.SkipTest('sliced scroll requires Elastic 5.0 or later')
+        shards = len(self.ctx.elastic_search(self.index, self.doc_type).parts())
+
+        combined = self.ctx.elastic_search(self.index, self.doc_type, docs_per_partition=1000)
+        self.assertEqual(len(combined.parts()), 1)
+        ids = combined.pluck('_id').collect()
+        self.assertEqual(sorted(ids, key=int), [str(i) for i in range(100)])
+        self.assertEqual(combined.count(), 100)
+
+        split = self.ctx.elastic_search(self.index, self.doc_type, docs_per_partition=100 // shards // 2)
+        self.assertGreater(len(split.parts()), shards)
+        ids = split.pluck('_id').collect()
+        self.assertEqual(sorted(ids, key=int), [str(i) for i in range(100)])
+
+    def test_aggregate(self):
+        dset = self.ctx.elastic_search(self.index, self.doc_type)
+        stats = dset.field_stats('number')
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['min'], 0)
+        self.assertEqual(stats['max'], 99)
+        self.assertEqual(stats['sum'], sum(range(100)))
+
+        dset = self.ctx.elastic_search(self.index, self.doc_type, query={
+            'query': { 'range': { 'number': { 'lt': 10 } } }
+        })
+        self.assertEqual(dset.field_stats('number')['max'], 9)
+        self.assertEqual(dset.field_terms('number', size=100), {i: 1 for i in range(10)})
+        aggs = dset.elastic_aggregate({'max_number': {'max': {'field': 'number'}}})
+        self.assertEqual(aggs['max_number']['value'], 9)
+
+        # the aggregate and count of bndl still work
+        dset = self.ctx.elastic_search(self.index, self.doc_type).pluck('_source').pluck('number')
+        self.assertEqual(dset.sum(), sum(range(100)))
+        self.assertEqual(dset.max(), 99)
+        count = lambda part: sum(1 for _ in part)
+        self.assertEqual(self.ctx.elastic_search(self.index, self.doc_type).aggregate(count, sum), 100)
+
+    def test_cached(self):
+        dset = self.ctx.elastic_search(self.index, self.doc_type).cache()
+        self.assertEqual(dset.count(), 100)
+        self.assertEqual(sorted(dset.pluck('_id').map(int).collect()), list(range(100)))
+        with self.ctx.elastic_client() as client:
+            client.delete(self.index, self.doc_type, 0, refresh=True)
+        # the cached documents are counted and plucked
+        self.assertEqual(dset.count(), 100)
+        self.assertEqual(dset.count(push_down=True), 99)
+        self.assertEqual(sorted(dset.pluck('_id').map(int).collect()), list(range(100)))
+        dset.uncache()
+
+
+    def test_select_where(self):
+        dset = self.ctx.elastic_search(self.index, self.doc_type)
+        sources = dset.select('name').pluck('_source').collect()
+        self.assertEqual(len(sources), 100)
+        self.assertTrue(all(list(source.keys()) == ['name'] for source in sources))
+
+        selected = dset.where({'range': {'number': {'gte': 20, 'lt': 50}}})
+        self.assertEqual(selected.count(), 30)
+        self.assertEqual(sorted(selected.pluck('_id').map(int).collect()), list(range(20, 50)))
+        self.assertEqual(selected.where({'range': {'number': {'lt': 30}}}).count(), 10)
+        self.assertEqual(self.ctx.elastic_search(self.index, self.doc_type, q='10').where({'range': {'number': {'lt': 30}}}).count(), 1)
+
+
+    def test_changed_since(self):
+        dset = self.ctx.elastic_search(self.index, self.doc_type).changed_since('number')
+        self.assertEqual(dset.count(), 100)
+        self.assertEqual(len(dset.collect()), 100)
+        checkpoint = dset.checkpoint()
+
+        changes = self.ctx.elastic_search(self.index, self.doc_type).changed_since('number', checkpoint)
+        self.assertEqual(changes.count(), 0)
+        self.assertEqual(changes.collect(), [])
+
+        with self.ctx.elastic_client() as client:
+            for i in range(5):
+                client.index(self.index, self.doc_type, {'name': str(i), 'number': 100 + i}, id=i)
+            client.indices.refresh(self.index)
+
+        changes = self.ctx.elastic_search(self.index, self.doc_type).changed_since('number', checkpoint)
+        self.assertEqual(changes.count(), 5)
+        self.assertEqual(sorted(changes.pluck('_id').map(int).collect()), list(range(5)))
+        self.assertTrue(all(changes.checkpoint()[key] >= value for key, value in checkpoint.items()))
+
+
+    def test_changed_since_chained(self):
+        dset = self.ctx.elastic_search(self.index, self.doc_type).changed_since('number')
+        self.assertEqual(len(dset.collect()), 100)
+
+        with self.ctx.elastic_client() as client:
+            for batch in range(3):
+                dset = dset.changed_since('number', dset.checkpoint())
+                self.assertEqual(dset.collect(), [])
+
+                for i in range(5):
+                    client.index(self.index, self.doc_type, {'name': str(i), 'number': 100 + batch * 5 + i}, id=i)
+                client.indices.refresh(self.index)
+
+                dset = dset.changed_since('number', dset.checkpoint())
+                self.assertEqual(dset.count(), 5)
+                self.assertEqual(sorted(dset.pluck('_id').map(int).collect()), list(range(5)))
+
+
+    def test_search_after(self):
+        with self.ctx.elastic_client() as client:
+            if elastic_version(client) < (7, 10):
+                raise unittest.SkipTest('point in time requires Elastic 7.10 or later')
+        dset = self.ctx.elastic_search(self.index, self.doc_type, engine='search_after', size=7)
+        ids = dset.pluck('_id').collect()
+        self.assertEqual(sorted(ids, key=int), [str(i) for i in range(100)])
+        self.assertEqual(dset.where({'range': {'number': {'lt': 10}}}).map(lambda hit: 1).sum(), 10)
+
+    def test_prefetch(self):
+        dset = self.ctx.elastic_search(self.index, self.doc_type, prefetch=2, size=7)
+        ids = dset.pluck('_id').collect()
+        self.assertEqual(sorted(ids, key=int), [str(i) for i in range(100)])
+        self.assertEqual(dset.first()['_index'], self.index)
+
+    def test_compact_hits(self):
+        dset = self.ctx.elastic_search(self.index, self.doc_type, compact_hits=True)
+        ids = dset.pluck('_id').collect()
+        self.assertEqual(sorted(ids, key=int), [str(i) for i in range(100)])
+        hits = dset.shuffle().collect()
+        self.assertEqual(len(hits), 100)
+        self.assertEqual(hits[0]['_index'], self.index)
+        self.assertEqual(sorted(hit['_source']['number'] for hit in hits), list(range(100)))
+
+    def test_columns(self):
+        with self.ctx.elastic_client() as client:
+            if elastic_version(client) < (5,):
+                raise unittest.SkipTest('docvalue_fields requires Elastic 5.0 or later')
+        rows = self.ctx.elastic_search(self.index, self.doc_type, columns=['_id', 'number']).collect()
+        self.assertEqual(sorted(rows, key=lambda row: row[1]), [(str(i), i) for i in range(100)])
+
+        arrays = self.ctx.elastic_search(self.index, self.doc_type, columns=['_id', 'number'], as_arrays=True, size=30)
+        batches = arrays.collect()
+        self.assertEqual(arrays.count(), len(batches))
+        self.assertTrue(all(len(batch['number']) <= 30 for batch in batches))
+        self.assertEqual(sum(batch['number'].sum() for batch in batches), sum(range(100)))
+
+
+
+class FakePitClient(object):
+    def __init__(self, version, docs):
+        self.version = version
+        self.docs = docs
+        self.transport = self
+        self.bodies = []
+
+    def info(self):
+        return {'version': {'number': self.version}}
+
+    def perform_request(self, method, url, params=None, body=None):
+        return {'id': 'pit'}
+
+    def search(self, body, **kwargs):
+        self.bodies.append(dict(body))
+        start = body['search_after'][0] + 1 if 'search_after' in body else 0
+        hits = [{'_id': str(i), 'sort': [i]} for i in range(start, min(start + body['size'], self.docs))]
+        return {'hits': {'hits': hits}}
+
+
+
+class SearchAfterEngineTest(unittest.TestCase):
+    def test_tiebreaker(self):
+        for version, tiebreaker in (('7.10.2', '_doc'), ('7.11.0', '_doc'), ('7.12.0', '_shard_doc')):
+            client = FakePitClient(version, 5)
+            hits = list(search_after(client, 'index', None, '_shards:0', size=2))
+            self.assertEqual([hit['_id'] for hit in hits], ['0', '1', '2', '3', '4'])
+            self.assertEqual(client.bodies[0]['sort'], [{tiebreaker: 'asc'}])
@@ -0,0 +1,49 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import date
+from decimal import Decimal
+from unittest import TestCase
+import json
+
+from bndl_elastic import serializers
+from elasticsearch.serializer import JSONSerializer
+
+
+class SerializerTest(TestCase):
+    doc = {'name': 'x', 'number': 1, 'nested': {'list': [1.5, None, True]}, 'text': 'é'}
+
+    def _check(self, ser):
+        self.assertEqual(json.loads(ser.dumps(self.doc)), self.doc)
+        self.assertEqual(ser.loads(json.dumps(self.doc)), self.doc)
+        self.assertEqual(ser.dumps('{"raw": 1}'), '{"raw": 1}')
+        self.assertEqual(json.loads(ser.dumps({'date': date(2017, 1, 2), 'dec': Decimal('1.5')})),
+                         {'date': '2017-01-02', 'dec': 1.5})
+
+    def test_json(self):
+        self._check(serializers.get_serializer('json'))
+
+    def test_orjson(self):
+        if not serializers.orjson:
+            self.skipTest('orjson not installed')
+        self._check(serializers.get_serializer('orjson'))
+
+    def test_ujson(self):
+        if not serializers.ujson:
+            self.skipTest('ujson not installed')
+        self._check(serializers.get_serializer('ujson'))
+
+    def test_auto(self):
+        ser = serializers.get_serializer('auto')
+        self.assertIsInstance(ser, JSONSerializer)
+        with self.assertRaises(ValueError):
+            serializers.get_serializer('xml')
@@ -0,0 +1,53 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+import threading
+
+from bndl_elastic.benchmarks.standin import StandInConfig, create_server
+from elasticsearch.client import Elasticsearch
+from elasticsearch.helpers import scan
+
+
+class StandInTest(TestCase):
+    def setUp(self):
+        self.server = create_server(StandInConfig(shards=3, docs_per_shard=100, doc_size=200))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = Elasticsearch(['%s:%s' % self.server.server_address[:2]])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_scan(self):
+        resp = self.client.search_shards('test')
+        self.assertEqual(len(resp['shards']), 3)
+        self.assertEqual(self.client.count('test')['count'], 300)
+
+        hits = list(scan(self.client, index='test', preference='_shards:1', size=30))
+        self.assertEqual(len(hits), 100)
+        self.assertEqual(len({hit['_id'] for hit in hits}), 100)
+        self.assertEqual(hits[0]['_source']['number'], 42)
+
+        sliced = [
+            list(scan(self.client, index='test', preference='_shards:1', size=30,
+                      query={'slice': {'id': slice_id, 'max': 3}}))
+            for slice_id in range(3)
+        ]
+        self.assertEqual(sorted(hit['_id'] for part in sliced for hit in part),
+                         sorted(hit['_id'] for hit in hits))
+
+    def test_bulk(self):
+        body = '{"create":{"_id":1}}\n{"a":1}\n{"delete":{"_id":2}}\n{"index":{}}\n{"a":2}\n'
+        resp = self.client.bulk(body)
+        self.assertFalse(resp['errors'])
+        self.assertEqual([next(iter(item)) for item in resp['items']], ['create', 'delete', 'index'])
@@ -0,0 +1,183 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tuning of index settings for bulk loads: refresh disabled, no replicas and
+asynchronous translog durability while loading.
+'''
+
+from contextlib import contextmanager
+import atexit
+import logging
+import threading
+
+from bndl.compute.dataset import Dataset, Partition
+from bndl_elastic.client import elastic_client
+
+
+logger = logging.getLogger(__name__)
+
+
+BULK_LOAD_SETTINGS = {
+    'index.refresh_interval': '-1',
+    'index.number_of_replicas': 0,
+    'index.translog.durability': 'async',
+}
+
+
+# the indices tuned by this process as (hosts, index name) to [the original
+# settings, the number of bulk loads which use the tuning]
+_tuned = {}
+_tuned_lock = threading.Lock()
+
+
+def _hosts_key(hosts):
+    return hosts if hosts is None or isinstance(hosts, str) else tuple(hosts)
+
+
+def tune_for_bulk_load(ctx, index, hosts=None):
+    '''
+    Apply BULK_LOAD_SETTINGS to the given indices.
+
+    The tuning is reference counted per index: indices which are already
+    tuned (e.g. by a concurrent bulk load) aren't tuned again and their
+    original settings are restored when the last bulk load which uses them
+    calls restore_settings.
+
+    :param index: str
+        Comma separated names of the indices to tune.
+    :return: list
+        The names of the tuned indices, to be passed to restore_settings.
+    '''
+    key = _hosts_key(hosts)
+    with _tuned_lock, elastic_client(ctx, hosts=hosts) as client:
+        resp = client.indices.get_settings(index=index, flat_settings=True)
+        names = list(resp)
+        untuned = [name for name in names if (key, name) not in _tuned]
+        if untuned:
+            client.indices.put_settings(index=','.join(untuned), body=BULK_LOAD_SETTINGS)
+        for name in untuned:
+            settings = resp[name]['settings']
+            _tuned[key, name] = [{setting: settings.get(setting) for setting in BULK_LOAD_SETTINGS}, 0]
+        for name in names:
+            _tuned[key, name][1] += 1
+    return names
+
+
+def restore_settings(ctx, names, hosts=None, refresh=True):
+    '''
+    Release the tuning of indices as returned by tune_for_bulk_load. The
+    settings of the indices which aren't used by another bulk load anymore
+    are restored and (optionally) the indices are refreshed. Settings which
+    weren't set are reset to their defaults.
+    '''
+    key = _hosts_key(hosts)
+    with _tuned_lock, elastic_client(ctx, hosts=hosts) as client:
+        restored = []
+        for name in names:
+            tuned = _tuned.get((key, name))
+            if tuned is None:
+                continue
+            tuned[1] -= 1
+            if tuned[1]:
+                continue
+            del _tuned[key, name]
+            restored.append(name)
+            try:
+                client.indices.put_settings(index=name, body=tuned[0])
+            except Exception:
+                logger.exception('Unable to restore the settings of index %s to %s', name, tuned[0])
+        if refresh and restored:
+            client.indices.refresh(','.join(restored))
+
+
+@contextmanager
+def bulk_load_mode(ctx, index, hosts=None):
+    '''
+    Context manager which tunes the settings of the given indices for bulk
+    loads, and restores them (also on failure) and refreshes the indices
+    when done. E.g.::
+
+        with bulk_load_mode(ctx, 'my_index'):
+            dset.elastic_index('my_index').execute()
+
+    :param ctx: bndl.compute.context.ComputeContext
+        The ComputeContext to use for getting the Elastic client.
+    :param index: str
+        Comma separated names of the indices to tune.
+    :param hosts: str or iterable (optional)
+        Hosts which serve as contact points for the Elastic client.
+    '''
+    names = tune_for_bulk_load(ctx, index, hosts)
+    try:
+        yield names
+    finally:
+        restore_settings(ctx, names, hosts)
+
+
+
+# the bulk load datasets which tuned indices and weren't cleaned up yet, these
+# are restored when the driver exits
+_pending = set()
+
+
+@atexit.register
+def _restore_pending():
+    for dset in list(_pending):
+        try:
+            dset._restore()
+        except Exception:
+            logger.exception('Unable to restore the settings of %s', dset.index)
+
+
+
+class BulkLoadDataset(Dataset):
+    '''
+    Dataset with the partitions of its source dataset which tunes the given
+    indices for bulk loads when the partitions of a job are planned (on the
+    driver) and restores the settings in the cleanup of the job. So building
+    the dataset doesn't change any settings and every execution is tuned.
+
+    As bndl has no hook for the start of a job, planning the partitions
+    outside of a job (e.g. ``len(dset.parts())``) tunes the indices until the
+    next job of the dataset is cleaned up or the driver exits.
+    '''
+
+    def __init__(self, src, index, hosts=None):
+        super().__init__(src.ctx, src)
+        self.index = index
+        self.hosts = hosts
+        self._tuned = None
+
+
+    def parts(self):
+        if self._tuned is None:
+            self._tuned = tune_for_bulk_load(self.ctx, self.index, self.hosts)
+            _pending.add(self)
+        return [BulkLoadPartition(self, idx, part) for idx, part in enumerate(self.src.parts())]
+
+
+    def cleanup(self, job):
+        self._restore()
+
+
+    def _restore(self):
+        tuned, self._tuned = self._tuned, None
+        _pending.discard(self)
+        if tuned is not None:
+            restore_settings(self.ctx, tuned, self.hosts)
+
+
+
+class BulkLoadPartition(Partition):
+    def _compute(self):
+        return self.src.compute()
@@ -49,6 +49,9 @@ setup(
         dev=[
             'bndl[dev]',
         ],
+        fastjson=[
+            'orjson',
+        ],
     ),
 
     entry_points={